@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare encoder backends of WebPConverter on a shared corpus.
+
+Every available encoder (see available_encoders()) converts the same photo-like
+and screenshot-like images, then all of them together with the per-image
+"smallest" policy. Usage:
+
+    python benchmarks/encoders.py --images 6 --size 1600x1200
+    python benchmarks/encoders.py --min-psnr 38
+"""
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "md-converter-gui"))
+
+
+def _make_corpus(count: int, width: int, height: int) -> list:
+    """Return PNG bytes of `count` images, alternating photos and screenshots."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    corpus = []
+    for i in range(count):
+        if i % 2 == 0:
+            image = Image.effect_noise((width, height), 40 + i).convert("RGB")
+            image = image.filter(ImageFilter.GaussianBlur(2))
+        else:
+            image = Image.new("RGB", (width, height), (248, 248, 248))
+            draw = ImageDraw.Draw(image)
+            for y in range(0, height, 18):
+                draw.text((12, y), f"line {y} of screenshot {i}", fill=(30, 30, 30))
+                draw.rectangle(
+                    [width // 2, y, width // 2 + y % 300, y + 10],
+                    fill=(40 * i % 255, 120, 200),
+                )
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        corpus.append(buffer.getvalue())
+    return corpus
+
+
+def _run(corpus: list, encoder, args) -> tuple:
+    from core.image_converter import WebPConverter
+
+    # bypass the encode cache, later runs would only read cached results
+    converter = WebPConverter(
+        args.quality, use_cache=False, encoder=encoder, min_psnr=args.min_psnr
+    )
+    total_bytes = 0
+    chosen = {}
+    started_at = time.perf_counter()
+    for source in corpus:
+        data, info = converter.encode_webp_detailed(source)
+        total_bytes += len(data)
+        chosen[info["encoder"]] = chosen.get(info["encoder"], 0) + 1
+    return time.perf_counter() - started_at, total_bytes, chosen
+
+
+def main():
+    from core.image_converter import available_encoders
+
+    parser = argparse.ArgumentParser(description="encoder backend benchmark")
+    parser.add_argument("--images", type=int, default=6)
+    parser.add_argument("--size", default="1600x1200")
+    parser.add_argument("--quality", type=int, default=73)
+    parser.add_argument(
+        "--min-psnr",
+        type=float,
+        default=None,
+        help="search the quality of every encoder for this PSNR floor",
+    )
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+
+    corpus = _make_corpus(args.images, width, height)
+    source_bytes = sum(len(source) for source in corpus)
+    encoders = available_encoders()
+
+    print(f"{args.images} images of {width}x{height}, {source_bytes / 1024:.0f} KB PNG")
+    floor = f"PSNR >= {args.min_psnr}" if args.min_psnr else f"quality {args.quality}"
+    print(f"encoders: {', '.join(encoders)}; {floor}")
+    # quality searches are memoized per process by content hash, so with a floor
+    # the "smallest" run reuses the qualities found by the single encoder runs
+    for encoder in encoders + [encoders]:
+        seconds, total_bytes, chosen = _run(corpus, encoder, args)
+        label = encoder if isinstance(encoder, str) else "smallest"
+        picks = ", ".join(f"{name} x{n}" for name, n in sorted(chosen.items()))
+        print(
+            f"{label:<9}: {seconds:7.2f}s  {total_bytes / 1024:9.1f} KB"
+            f"  ({total_bytes / source_bytes:6.1%})  {picks}"
+        )
+
+
+if __name__ == "__main__":
+    main()
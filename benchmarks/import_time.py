@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure the startup cost of imarkdown.
+
+Every statement runs in a fresh interpreter, the same way a CLI invocation or a
+short-lived batch job pays for it. Usage:
+
+    python benchmarks/import_time.py --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+STATEMENTS = {
+    "python": "pass",
+    "import imarkdown": "import imarkdown",
+    "import imarkdown.adapter": "import imarkdown.adapter",
+    "imarkdown.MdImageConverter": "import imarkdown; imarkdown.MdImageConverter",
+    "imarkdown.adapter.MdAdapterMapper[Local]": (
+        "from imarkdown.adapter import MdAdapterMapper; MdAdapterMapper['Local']"
+    ),
+}
+
+
+def _run(statement: str) -> float:
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", statement], check=True, env=env)
+    return (time.perf_counter() - start) * 1000
+
+
+def _heavy_modules(statement: str) -> list:
+    """Report which expensive third-party modules a statement pulls in."""
+    probe = (
+        f"{statement}\n"
+        "import sys\n"
+        "print(','.join(m for m in ('requests', 'pydantic', 'cushy_storage', "
+        "'oss2', 'boto3', 'qcloud_cos', 'qiniu') if m in sys.modules))"
+    )
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    out = subprocess.run(
+        [sys.executable, "-c", probe],
+        check=True,
+        env=env,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    return out.split(",") if out else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="imarkdown import-time benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'statement':<45}{'median ms':>12}{'min ms':>10}{'over python':>14}")
+    for label, statement in STATEMENTS.items():
+        samples = [_run(statement) for _ in range(args.runs)]
+        median = statistics.median(samples)
+        if baseline is None:
+            baseline = median
+        print(
+            f"{label:<45}{median:>12.1f}{min(samples):>10.1f}"
+            f"{median - baseline:>14.1f}"
+        )
+        heavy = _heavy_modules(statement)
+        if heavy:
+            print(f"{'':<4}loads: {', '.join(heavy)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare serial and process-pool WebP encoding in MarkdownImageProcessor.
+
+A document with 20 local photo-like images is converted once with a single
+encoder and once with one encoder per CPU core. Usage:
+
+    python benchmarks/webp_parallel.py --images 20 --size 1600x1200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "md-converter-gui"))
+
+
+def _make_corpus(directory: str, count: int, width: int, height: int) -> str:
+    """Write `count` noisy gradient PNGs and a markdown document referencing them."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    lines = ["# benchmark", ""]
+    for i in range(count):
+        noise = Image.effect_noise((width, height), 40 + i).convert("RGB")
+        draw = ImageDraw.Draw(noise)
+        for x in range(0, width, max(1, width // 12)):
+            draw.rectangle(
+                [x, 0, x + width // 24, height], fill=(20 * i % 255, x % 255, 120)
+            )
+        image = noise.filter(ImageFilter.GaussianBlur(1))
+        path = os.path.join(directory, f"photo_{i:02d}.png")
+        image.save(path)
+        lines.append(f"![photo {i}]({path})")
+    return "\n".join(lines)
+
+
+def _run(markdown: str, output_dir: str, quality: int, workers: int) -> float:
+    from core.image_converter import MarkdownImageProcessor
+
+    # bypass the encode cache, later runs would only read cached results
+    processor = MarkdownImageProcessor(quality, encode_workers=workers, use_cache=False)
+    started_at = time.perf_counter()
+    _, count, _ = processor.process_markdown(markdown, output_dir)
+    elapsed = time.perf_counter() - started_at
+    assert count > 0, "no image converted"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel WebP encoding benchmark")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--size", default="1600x1200")
+    parser.add_argument("--quality", type=int, default=73)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        markdown = _make_corpus(directory, args.images, width, height)
+        output_dir = os.path.join(directory, "out", "images")
+
+        serial = _run(markdown, output_dir, args.quality, 1)
+        # first parallel run includes starting the worker processes
+        cold = _run(markdown, output_dir, args.quality, args.workers)
+        warm = _run(markdown, output_dir, args.quality, args.workers)
+
+    print(f"{args.images} images of {width}x{height}, quality {args.quality}")
+    print(f"serial (1 process)       : {serial:7.2f}s")
+    print(
+        f"parallel cold ({args.workers:>2} procs) : {cold:7.2f}s  x{serial / cold:.2f}"
+    )
+    print(
+        f"parallel warm ({args.workers:>2} procs) : {warm:7.2f}s  x{serial / warm:.2f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
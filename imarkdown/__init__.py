@@ -1,12 +1,30 @@
-from imarkdown.adapter.aliyun_adapter import AliyunAdapter
-from imarkdown.adapter.base import BaseMdAdapter
-from imarkdown.adapter.local_adapter import LocalFileAdapter
-from imarkdown.converter import (
-    BaseElementFinder,
-    BaseMdImageConverter,
-    MdImageConverter,
-)
-from imarkdown.schema import MdFile, MdFolder
+"""imarkdown loads its public members on first attribute access, so `import imarkdown`
+does not pay for the adapters, pydantic models or requests until they are used."""
+
+import importlib
+from typing import TYPE_CHECKING, Any, Dict
+
+if TYPE_CHECKING:
+    from imarkdown.adapter.aliyun_adapter import AliyunAdapter
+    from imarkdown.adapter.base import BaseMdAdapter
+    from imarkdown.adapter.local_adapter import LocalFileAdapter
+    from imarkdown.converter import (
+        BaseElementFinder,
+        BaseMdImageConverter,
+        MdImageConverter,
+    )
+    from imarkdown.schema import MdFile, MdFolder
+
+_LAZY_ATTRIBUTES: Dict[str, str] = {
+    "MdImageConverter": "imarkdown.converter",
+    "BaseMdImageConverter": "imarkdown.converter",
+    "BaseElementFinder": "imarkdown.converter",
+    "MdFile": "imarkdown.schema",
+    "MdFolder": "imarkdown.schema",
+    "BaseMdAdapter": "imarkdown.adapter.base",
+    "LocalFileAdapter": "imarkdown.adapter.local_adapter",
+    "AliyunAdapter": "imarkdown.adapter.aliyun_adapter",
+}
 
 __all__ = [
     "MdImageConverter",
@@ -18,3 +36,15 @@ __all__ = [
     "AliyunAdapter",
     "BaseElementFinder",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
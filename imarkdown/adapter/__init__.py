@@ -1,14 +1,17 @@
-from typing import Dict
-
-from imarkdown.adapter.aliyun_adapter import AliyunAdapter
-from imarkdown.adapter.base import BaseMdAdapter
-from imarkdown.adapter.cos_adapter import CosAdapter
-from imarkdown.adapter.github_adapter import GitHubAdapter
-from imarkdown.adapter.local_adapter import LocalFileAdapter
-from imarkdown.adapter.qiniu_adapter import QiniuAdapter
-from imarkdown.adapter.s3_adapter import S3Adapter
+import importlib
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Mapping, Type
+
 from imarkdown.constant import MdAdapterType
 
+if TYPE_CHECKING:
+    from imarkdown.adapter.aliyun_adapter import AliyunAdapter
+    from imarkdown.adapter.base import BaseMdAdapter
+    from imarkdown.adapter.cos_adapter import CosAdapter
+    from imarkdown.adapter.github_adapter import GitHubAdapter
+    from imarkdown.adapter.local_adapter import LocalFileAdapter
+    from imarkdown.adapter.qiniu_adapter import QiniuAdapter
+    from imarkdown.adapter.s3_adapter import S3Adapter
+
 __all__ = [
     "BaseMdAdapter",
     "AliyunAdapter",
@@ -20,11 +23,58 @@ __all__ = [
     "MdAdapterMapper",
 ]
 
-MdAdapterMapper: Dict[str, type(BaseMdAdapter)] = {
-    MdAdapterType.Local: LocalFileAdapter,
-    MdAdapterType.Aliyun: AliyunAdapter,
-    MdAdapterType.COS: CosAdapter,
-    MdAdapterType.Qiniu: QiniuAdapter,
-    MdAdapterType.S3: S3Adapter,
-    MdAdapterType.GitHub: GitHubAdapter,
+_ADAPTER_MODULES: Dict[str, str] = {
+    "BaseMdAdapter": "imarkdown.adapter.base",
+    "LocalFileAdapter": "imarkdown.adapter.local_adapter",
+    "AliyunAdapter": "imarkdown.adapter.aliyun_adapter",
+    "CosAdapter": "imarkdown.adapter.cos_adapter",
+    "QiniuAdapter": "imarkdown.adapter.qiniu_adapter",
+    "S3Adapter": "imarkdown.adapter.s3_adapter",
+    "GitHubAdapter": "imarkdown.adapter.github_adapter",
 }
+
+
+def _import_adapter(class_name: str) -> Any:
+    return getattr(importlib.import_module(_ADAPTER_MODULES[class_name]), class_name)
+
+
+class _LazyAdapterMapper(Mapping):
+    """Map MdAdapterType to adapter class. An adapter module is imported the first
+    time its type is looked up, so loading the default adapter does not import every
+    cloud SDK wrapper."""
+
+    def __init__(self, class_names: Dict[str, str]):
+        self._class_names = class_names
+
+    def __getitem__(self, adapter_type: str) -> "Type[BaseMdAdapter]":
+        return _import_adapter(self._class_names[adapter_type])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._class_names)
+
+    def __len__(self) -> int:
+        return len(self._class_names)
+
+
+MdAdapterMapper: Mapping = _LazyAdapterMapper(
+    {
+        MdAdapterType.Local: "LocalFileAdapter",
+        MdAdapterType.Aliyun: "AliyunAdapter",
+        MdAdapterType.COS: "CosAdapter",
+        MdAdapterType.Qiniu: "QiniuAdapter",
+        MdAdapterType.S3: "S3Adapter",
+        MdAdapterType.GitHub: "GitHubAdapter",
+    }
+)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _ADAPTER_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = _import_adapter(name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
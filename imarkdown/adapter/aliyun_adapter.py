@@ -8,7 +8,6 @@ from imarkdown.config import IMarkdownConfig
 from imarkdown.utils import polish_path
 
 logger = logging.getLogger(__name__)
-cfg: IMarkdownConfig = IMarkdownConfig()
 
 
 class AliyunAdapter(BaseMdAdapter):
@@ -32,6 +31,7 @@ class AliyunAdapter(BaseMdAdapter):
     @root_validator(pre=True)
     def validate_environment(cls, values: Optional[Dict]) -> Dict:
         # update adapter config to cache
+        cfg = IMarkdownConfig()
         env_config: Dict[str, Any] = cfg.load_variable(cls.__name__)
         if env_config:
             if not values:
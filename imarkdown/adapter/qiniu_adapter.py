@@ -8,7 +8,6 @@ from imarkdown.config import IMarkdownConfig
 from imarkdown.utils import polish_path
 
 logger = logging.getLogger(__name__)
-cfg: IMarkdownConfig = IMarkdownConfig()
 
 
 class QiniuAdapter(BaseMdAdapter):
@@ -29,6 +28,7 @@ class QiniuAdapter(BaseMdAdapter):
     @root_validator(pre=True)
     def validate_environment(cls, values: Optional[Dict]) -> Dict:
         # update adapter config to cache
+        cfg = IMarkdownConfig()
         env_config: Dict[str, Any] = cfg.load_variable(cls.__name__)
         if env_config:
             if not values:
@@ -0,0 +1,308 @@
+"""Command-line entry point of imarkdown.
+
+Examples:
+    python -m imarkdown docs/README.md
+    python -m imarkdown docs -o dist/docs --workers 8 --incremental
+    python -m imarkdown docs -o dist/docs --dry-run --json-report report.json
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from imarkdown.config import IMarkdownConfig
+from imarkdown.constant import MdAdapterType
+from imarkdown.utils import convert_backslashes, supplementary_file_path
+
+logger = logging.getLogger(__name__)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+_INCREMENTAL_KEY_PREFIX = "cli:incremental:"
+
+
+class _Task:
+    """One markdown file to convert and where its result goes."""
+
+    def __init__(self, md_file_path: str, output_directory: Optional[str]):
+        self.md_file_path = md_file_path
+        self.output_directory = output_directory
+        self.enable_rename = output_directory is None
+
+    @property
+    def output_path(self) -> str:
+        directory = self.output_directory or os.path.dirname(self.md_file_path)
+        name = os.path.basename(self.md_file_path)[:-3]
+        if self.enable_rename:
+            name = f"{name}_converted"
+        return convert_backslashes(os.path.join(directory, f"{name}.md"))
+
+
+def _collect_tasks(
+    paths: Sequence[str], output_directory: Optional[str]
+) -> Tuple[List[_Task], List[str]]:
+    """Expand files and folders into conversion tasks.
+
+    Returns:
+        A list of tasks and a list of usage errors.
+    """
+    tasks: List[_Task] = []
+    errors: List[str] = []
+    output_root = (
+        supplementary_file_path(output_directory) if output_directory else None
+    )
+
+    for path in paths:
+        path = supplementary_file_path(path)
+        if os.path.isfile(path):
+            if not path.endswith(".md"):
+                errors.append(f"<{path}> is not markdown file.")
+                continue
+            tasks.append(_Task(path, output_root))
+        elif os.path.isdir(path):
+            if not output_root:
+                errors.append(
+                    f"<{path}> is a folder, you must set --output-directory to convert it."
+                )
+                continue
+            folder_output = convert_backslashes(
+                os.path.join(output_root, os.path.basename(path.rstrip("/")))
+            )
+            for root, dirs, files in os.walk(path):
+                root = convert_backslashes(root)
+                # never convert our own output again
+                dirs[:] = [
+                    d
+                    for d in dirs
+                    if convert_backslashes(os.path.join(root, d)) != output_root
+                ]
+                relative = os.path.relpath(root, path)
+                target = folder_output
+                if relative != ".":
+                    target = convert_backslashes(os.path.join(folder_output, relative))
+                for file in sorted(files):
+                    if file.endswith(".md"):
+                        tasks.append(_Task(f"{root}/{file}", target))
+        else:
+            errors.append(f"<{path}> does not exists.")
+    return tasks, errors
+
+
+def _fingerprint(md_file_path: str, adapter_name: str) -> str:
+    with open(md_file_path, "rb") as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(adapter_name.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_adapter(adapter_name: Optional[str]):
+    from imarkdown.adapter import MdAdapterMapper
+
+    cfg = IMarkdownConfig()
+    adapter_name = adapter_name or cfg.last_adapter_name
+    return MdAdapterMapper[adapter_name]()
+
+
+def _convert_one(task: _Task, adapter, args: argparse.Namespace) -> Dict[str, Any]:
+    from imarkdown.converter import BaseMdImageConverter, _read_md
+
+    record: Dict[str, Any] = {
+        "path": task.md_file_path,
+        "output": task.output_path,
+        "status": "converted",
+        "images": 0,
+        "seconds": 0.0,
+        "stage_timings": {},
+    }
+    started_at = time.perf_counter()
+    try:
+        converter = BaseMdImageConverter(
+            adapter=adapter,
+            is_local_images=args.local_images,
+            enable_save_images=not args.no_save_images,
+        )
+        fingerprint = None
+        if args.incremental:
+            fingerprint = _fingerprint(task.md_file_path, adapter.name)
+            cache = IMarkdownConfig().cache
+            key = f"{_INCREMENTAL_KEY_PREFIX}{task.output_path}"
+            if cache.get(key) == fingerprint and os.path.exists(task.output_path):
+                record["status"] = "skipped"
+                return record
+
+        if args.dry_run:
+            record["status"] = "dry-run"
+            record["images"] = len(converter.find_images(_read_md(task.md_file_path)))
+            return record
+
+        if task.output_directory:
+            os.makedirs(task.output_directory, exist_ok=True)
+        converter.convert(
+            task.md_file_path,
+            output_md_directory=task.output_directory,
+            enable_rename=task.enable_rename,
+        )
+        record["images"] = converter.converted_image_count
+        record["stage_timings"] = dict(converter.stage_timings)
+        if fingerprint:
+            IMarkdownConfig().cache.set(
+                f"{_INCREMENTAL_KEY_PREFIX}{task.output_path}", fingerprint
+            )
+    except Exception as e:
+        logger.debug("[imarkdown] cli conversion failed", exc_info=True)
+        record["status"] = "failed"
+        record["error"] = str(e)
+    finally:
+        record["seconds"] = time.perf_counter() - started_at
+    return record
+
+
+def _summarize(records: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    stage_timings: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    images = 0
+    for record in records:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+        images += record["images"]
+        for stage, seconds in record["stage_timings"].items():
+            stage_timings[stage] = stage_timings.get(stage, 0.0) + seconds
+
+    return {
+        "files": len(records),
+        "converted": counts.get("converted", 0),
+        "skipped": counts.get("skipped", 0),
+        "failed": counts.get("failed", 0),
+        "dry_run": counts.get("dry-run", 0),
+        "images": images,
+        "wall_seconds": wall_seconds,
+        "files_per_second": len(records) / wall_seconds if wall_seconds else 0.0,
+        "images_per_second": images / wall_seconds if wall_seconds else 0.0,
+        "stage_timings": stage_timings,
+    }
+
+
+def _print_summary(records: List[Dict[str, Any]], summary: Dict[str, Any]):
+    for record in records:
+        line = f"[{record['status']}] {record['path']}"
+        if record["status"] in ("converted", "dry-run"):
+            line += f" ({record['images']} images, {record['seconds']:.2f}s)"
+        if record.get("error"):
+            line += f": {record['error']}"
+        print(line)
+
+    print(
+        f"{summary['files']} files: {summary['converted']} converted, "
+        f"{summary['skipped']} skipped, {summary['failed']} failed, "
+        f"{summary['dry_run']} dry-run"
+    )
+    print(
+        f"{summary['images']} images in {summary['wall_seconds']:.2f}s "
+        f"({summary['files_per_second']:.2f} files/s, "
+        f"{summary['images_per_second']:.2f} images/s)"
+    )
+    if summary["stage_timings"]:
+        stages = ", ".join(
+            f"{stage} {seconds:.2f}s"
+            for stage, seconds in sorted(summary["stage_timings"].items())
+        )
+        print(f"stage timings (summed over workers): {stages}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="imarkdown",
+        description="Convert markdown image links with the cached imarkdown adapter.",
+    )
+    parser.add_argument("paths", nargs="+", help="markdown files or folders")
+    parser.add_argument(
+        "-o",
+        "--output-directory",
+        help="output directory, necessary when converting a folder",
+    )
+    parser.add_argument(
+        "-a",
+        "--adapter",
+        choices=[adapter_type.value for adapter_type in MdAdapterType],
+        help="adapter to use, default is the last adapter in the cached config",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=min(32, (os.cpu_count() or 1) + 4),
+        help="number of files converted in parallel",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only list files and image counts, nothing is downloaded or written",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip files which have not changed since their last conversion",
+    )
+    parser.add_argument("--json-report", help="write a JSON report to this path")
+    parser.add_argument(
+        "--local-images",
+        action="store_true",
+        help="markdown image links are local paths",
+    )
+    parser.add_argument(
+        "--no-save-images",
+        action="store_true",
+        help="delete downloaded images after uploading them",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    if args.workers < 1:
+        print("--workers must be at least 1", file=sys.stderr)
+        return EXIT_USAGE
+
+    tasks, errors = _collect_tasks(args.paths, args.output_directory)
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        return EXIT_USAGE
+
+    try:
+        adapter = _load_adapter(args.adapter)
+    except Exception as e:
+        print(f"Can not load adapter from cached config: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    started_at = time.perf_counter()
+    records: List[Dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(_convert_one, task, adapter, args) for task in tasks]
+        for future in as_completed(futures):
+            records.append(future.result())
+    records.sort(key=lambda record: record["path"])
+    IMarkdownConfig().flush()
+
+    summary = _summarize(records, time.perf_counter() - started_at)
+    _print_summary(records, summary)
+    if args.json_report:
+        with open(args.json_report, "w", encoding="utf-8") as f:
+            json.dump(
+                {"adapter": adapter.name, "summary": summary, "files": records},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+    return EXIT_FAILED if summary["failed"] else EXIT_OK
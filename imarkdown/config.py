@@ -1,25 +1,69 @@
+import atexit
+import copy
+import json
 import logging
 import os
-from typing import Any
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set
 
 from imarkdown.constant import MdAdapterType, _MdAdapterType
-from imarkdown.utils.cache import Cache
 from imarkdown.utils.singleton import Singleton
 
+if TYPE_CHECKING:
+    from imarkdown.utils.cache import BaseCache
+
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+"""Marks a key that has been looked up in the disk cache and does not exist."""
+
 
 class IMarkdownConfig(metaclass=Singleton):
+    """Global imarkdown config. Reads go through an in-memory snapshot of the disk
+    cache and writes only mark keys as dirty, so the cache files are touched once
+    per key until `flush` writes all pending changes in one batch."""
+
     def __init__(self):
-        self.cache = Cache()
+        self._cache: Optional["BaseCache"] = None
         self.root_path = os.path.abspath(os.path.dirname(__file__))
+        self._snapshot: Dict[str, Any] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    @property
+    def cache(self) -> "BaseCache":
+        """Disk cache, opened on first use rather than when the config is created."""
+        if self._cache is None:
+            from imarkdown.utils.cache import Cache
+
+            self._cache = Cache()
+        return self._cache
+
+    def _get(self, key: str) -> Any:
+        with self._lock:
+            if key not in self._snapshot:
+                self._snapshot[key] = self.cache.get(key, _MISSING)
+            value = self._snapshot[key]
+        return None if value is _MISSING else value
+
+    def _set(self, key: str, value: Any):
+        # Keep a private copy, adapter validators keep mutating the dict they store.
+        value = copy.deepcopy(value)
+        with self._lock:
+            if key not in self._snapshot:
+                self._snapshot[key] = self.cache.get(key, _MISSING)
+            if self._snapshot[key] == value:
+                return
+            self._snapshot[key] = value
+            self._dirty.add(key)
 
     @property
     def last_adapter_name(self) -> str:
         """Obtain the last executed MdAdapter, return LocalFileAdapter if obtain None.
         Custom MdAdapter currently can not use last adapter name.
         """
-        adapter_name = self.cache.get("last_adapter", None)
+        adapter_name = self._get("last_adapter")
         logger.debug(f"[imarkdown] get last adapter <{adapter_name}>")
         if not adapter_name or adapter_name not in _MdAdapterType.keys():
             return MdAdapterType.Local
@@ -29,10 +73,60 @@ class IMarkdownConfig(metaclass=Singleton):
     def last_adapter_name(self, value: str):
         # if value not in _MdAdapterType.keys():
         #     raise ValueError(f"<{value}> type adapter not exist.")
-        self.cache["last_adapter"] = value
+        self._set("last_adapter", value)
+
+    def use_cache(self, cache: "BaseCache"):
+        """Replace the default SQLite cache with another `BaseCache` backend. Pending
+        changes are written to the old backend first."""
+        self.flush()
+        with self._lock:
+            self._cache = cache
+            self._snapshot.clear()
 
     def load_variable(self, key: str) -> Any:
-        return self.cache.get(key, None)
+        return self._get(key)
 
     def store_variable(self, key: str, value: Any) -> Any:
-        self.cache[key] = value
+        self._set(key, value)
+
+    @property
+    def dirty(self) -> bool:
+        """Whether there are changes which have not been written to disk yet."""
+        return bool(self._dirty)
+
+    def flush(self):
+        """Write all dirty keys to the cache in one batch. The batch is a single
+        transaction, so a crash never leaves a half written config behind. A key
+        whose value can not be serialized is dropped from the batch and logged."""
+        with self._lock:
+            if not self._dirty:
+                return
+            pending = {key: self._snapshot[key] for key in self._dirty}
+            self._dirty.clear()
+
+        for key, value in list(pending.items()):
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                continue
+            try:
+                json.dumps(value, ensure_ascii=False)
+            except (TypeError, ValueError) as e:
+                logger.error(f"[imarkdown] drop config key <{key}>, reason: {e}")
+                del pending[key]
+        if not pending:
+            return
+
+        try:
+            self.cache.set_many(pending)
+        except Exception as e:
+            logger.error(f"[imarkdown] flush config failed, reason: {e}")
+            with self._lock:
+                self._dirty.update(pending.keys())
+            return
+        logger.debug(f"[imarkdown] flushed config keys {list(pending.keys())}")
+
+    def reload(self):
+        """Drop the in-memory snapshot so the next access reads from disk again.
+        Pending changes are flushed first."""
+        self.flush()
+        with self._lock:
+            self._snapshot.clear()
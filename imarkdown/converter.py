@@ -1,13 +1,13 @@
 import logging
 import os
-import random
 import re
 import time
 import traceback
+import uuid
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Union
 
-import requests
 from pydantic import BaseModel, Field, root_validator
 
 from imarkdown.adapter import BaseMdAdapter, MdAdapterMapper
@@ -20,9 +20,20 @@ from imarkdown.utils import (
     polish_path,
     supplementary_file_path,
 )
+from imarkdown.utils.data_uri import (
+    data_uri_extension,
+    decode_data_uri,
+    is_data_uri,
+    mask_data_uris,
+    shorten_data_uri,
+    unmask_data_uris,
+)
+from imarkdown.utils.host_scheduler import THROTTLE_STATUS_CODES, get_host_scheduler
 
 logger = logging.getLogger(__name__)
-cfg = IMarkdownConfig()
+
+_THROTTLE_RETRIES = 3
+"""How many times a download is retried after the host answered 429 or 503."""
 
 
 def _read_md(file_path: str) -> str:
@@ -41,6 +52,30 @@ def _write_data(new_file_path: str, md_str: str):
         logger.info(f"[imarkdown] write successfully to <{new_file_path}>")
 
 
+def _store_image(
+    image_local_storage_directory: str, data: bytes, extension: str
+) -> str:
+    """Write image data to a new file which no other download can claim, return its path."""
+    # only relative directories are normalised, an absolute one must keep its root
+    image_local_storage_directory = polish_path(
+        image_local_storage_directory,
+        enable_prefix=not os.path.isabs(image_local_storage_directory),
+    )
+    if not os.path.exists(image_local_storage_directory):
+        os.makedirs(image_local_storage_directory, exist_ok=True)
+
+    now_time = time.strftime("%Y%m%d_%H%M%S", time.localtime(time.time()))
+    while True:
+        images_path = f"{image_local_storage_directory}{now_time}{uuid.uuid4().hex[:8]}{extension}"
+        try:
+            # "xb" fails instead of overwriting an image stored by a concurrent download
+            with open(images_path, "xb") as f:
+                f.write(data)
+            return images_path
+        except FileExistsError:
+            continue
+
+
 def _download_img(image_local_storage_directory: str, image_url: str) -> Optional[str]:
     """Download image from website and stored in image_local_storage_directory
 
@@ -51,16 +86,24 @@ def _download_img(image_local_storage_directory: str, image_url: str) -> Optiona
     Returns:
         Return converted image absolute path
     """
+    import requests
+
+    scheduler = get_host_scheduler()
     try:
-        response = requests.get(image_url)
-        now_time = time.strftime("%Y%m%d_%H%M%S", time.localtime(time.time()))
-        image_local_storage_directory = polish_path(image_local_storage_directory)
-        if not os.path.exists(image_local_storage_directory):
-            os.makedirs(image_local_storage_directory, exist_ok=True)
-
-        images_path = f"{image_local_storage_directory}{now_time}{random.randint(1000, 10000)}.png"
-        with open(images_path, "wb") as f:
-            f.write(response.content)
+        for _ in range(_THROTTLE_RETRIES + 1):
+            # the scheduler caps requests per host and delays throttled hosts
+            with scheduler.slot(image_url):
+                response = requests.get(image_url, timeout=(8, 25))
+            scheduler.report(
+                image_url, response.status_code, response.headers.get("Retry-After")
+            )
+            if response.status_code not in THROTTLE_STATUS_CODES:
+                break
+        else:
+            response.raise_for_status()
+        images_path = _store_image(
+            image_local_storage_directory, response.content, ".png"
+        )
         logger.info(f"[imarkdown] <{images_path}> has stored in local successfully")
         return images_path
     except Exception as e:
@@ -69,7 +112,29 @@ def _download_img(image_local_storage_directory: str, image_url: str) -> Optiona
         return None
 
 
+def _save_data_uri(image_local_storage_directory: str, data_uri: str) -> Optional[str]:
+    """Decode an inline base64 data URI image and store it like a downloaded image.
+
+    Returns:
+        Return stored image absolute path
+    """
+    try:
+        images_path = _store_image(
+            image_local_storage_directory,
+            decode_data_uri(data_uri),
+            data_uri_extension(data_uri),
+        )
+        logger.info(f"[imarkdown] inline image has stored in <{images_path}>")
+        return images_path
+    except Exception as e:
+        logger.error(
+            f"[imarkdown] <{shorten_data_uri(data_uri)}> decode failed, reason: {e}"
+        )
+        return None
+
+
 def _load_default_adapter() -> BaseMdAdapter:
+    cfg = IMarkdownConfig()
     logger.debug(f"[imarkdown] local default adapter <{cfg.last_adapter_name}>")
     return MdAdapterMapper[cfg.last_adapter_name]()
 
@@ -91,8 +156,10 @@ class ReElementFinder(BaseElementFinder):
         """Default regular expression to find images, you can custom re_rule."""
 
     def find_all_elements(self, md_str: str) -> List[str]:
+        # base64 data URIs are masked first, the rule never scans their payload
+        md_str, data_uris = mask_data_uris(md_str)
         elements = re.findall(self.re_rule, md_str)
-        return list(map(lambda item: item[1], elements))
+        return list(map(lambda item: unmask_data_uris(item[1], data_uris), elements))
 
 
 class BaseMdImageConverter(BaseModel):
@@ -114,6 +181,13 @@ class BaseMdImageConverter(BaseModel):
     """The converted markdown file name."""
     element_finder: BaseElementFinder = Field(default=ReElementFinder())
     """Element Finder can find all specified elements(like images) in markdown file."""
+    download_workers: int = 8
+    """Number of remote images downloaded concurrently. Requests per host and in total
+    are further limited by the shared host scheduler."""
+    stage_timings: Dict[str, float] = Field(default_factory=dict)
+    """Seconds spent in each stage (read, download, upload, write) since creation."""
+    converted_image_count: int = 0
+    """Number of images converted since creation."""
 
     class Config:
         arbitrary_types_allowed = True
@@ -127,9 +201,13 @@ class BaseMdImageConverter(BaseModel):
             f"[imarkdown] BaseMdImageConverter initialization params: {values}"
         )
         if "adapter" in values and values["adapter"]:
-            cfg.last_adapter_name = values["adapter"].name
+            IMarkdownConfig().last_adapter_name = values["adapter"].name
         return values
 
+    def _record_stage(self, stage: str, started_at: float):
+        elapsed = time.perf_counter() - started_at
+        self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + elapsed
+
     def set_md_file_original_directory(self, md_file_path: str):
         result = supplementary_file_path(md_file_path)
         result = "/".join(result.split("/")[:-1])
@@ -235,15 +313,38 @@ class BaseMdImageConverter(BaseModel):
                 f"{self.md_file_output_directory}/images"
             )
 
+        started_at = time.perf_counter()
         original_data: str = _read_md(md_file_path)
+        self._record_stage("read", started_at)
         modified_data: str = self._find_img_and_replace(original_data)
 
         converted_md_path = (
             f"{self.md_file_output_directory}/{self.converted_md_file_name}"
         )
+        started_at = time.perf_counter()
         _write_data(converted_md_path, modified_data)
+        self._record_stage("write", started_at)
         logger.info(f"[imarkdown] <{md_file_path}> converted task end")
 
+    def find_images(self, md_str: str) -> List[str]:
+        """Find the image links in markdown data which this converter will convert."""
+        _images = self.element_finder.find_all_elements(md_str)
+
+        images = []
+        for image in _images:
+            if image == "":
+                continue
+            # If current image link is local path URL and you need to web URL to a local path,
+            # the local path url will not be converted. Inline data URIs are always converted.
+            if (
+                not self.is_local_images
+                and not image.startswith("http")
+                and not is_data_uri(image)
+            ):
+                continue
+            images.append(image)
+        return images
+
     def _find_img_and_replace(self, md_str: str) -> str:
         """Input original markdown str and replace images address
         It can find `![]()` type image url and `<img/>` type image url
@@ -254,44 +355,80 @@ class BaseMdImageConverter(BaseModel):
         Returns:
             Markdown data for the image url has been changed.
         """
-        _images = self.element_finder.find_all_elements(md_str)
-
-        images = []
-        for image in _images:
-            if image == "":
-                continue
-            # If current image link is local path URL and you need to web URL to a local path,
-            # the local path url will not be converted.
-            if not self.is_local_images and not image.startswith("http"):
-                continue
-            images.append(image)
+        images = self.find_images(md_str)
+        downloaded = self._download_images(images)
 
+        converted_urls: Dict[str, str] = {}
         for image in images:
-            converted_image_url = self._get_converted_image_url(image)
-            md_str = md_str.replace(image, converted_image_url)
+            # str.replace already replaced every occurrence of a repeated image
+            if image not in converted_urls:
+                converted_urls[image] = self._get_converted_image_url(
+                    image, downloaded.get(image), fetched=image in downloaded
+                )
+                md_str = md_str.replace(image, converted_urls[image])
+            self.converted_image_count += 1
         logger.info(
             f"[imarkdown] All images conversion for this md file have been completed, ready to save to file."
         )
         return md_str
 
-    def _get_converted_image_url(self, original_image_url: str) -> str:
+    def _download_images(self, images: List[str]) -> Dict[str, Optional[str]]:
+        """Download remote images concurrently and return their local paths.
+
+        Inline data URI images are decoded into files as well, also when the other
+        images are local."""
+        urls = [
+            url
+            for url in dict.fromkeys(images)
+            if is_data_uri(url) or not self.is_local_images
+        ]
+        if not urls:
+            return {}
+        started_at = time.perf_counter()
+        workers = max(1, min(self.download_workers, len(urls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = executor.map(self._fetch_image, urls)
+            downloaded = dict(zip(urls, paths))
+        self._record_stage("download", started_at)
+        return downloaded
+
+    def _fetch_image(self, image_url: str) -> Optional[str]:
+        if is_data_uri(image_url):
+            return _save_data_uri(self.image_local_storage_directory, image_url)
+        return _download_img(self.image_local_storage_directory, image_url)
+
+    def _get_converted_image_url(
+        self,
+        original_image_url: str,
+        downloaded_path: Optional[str] = None,
+        fetched: bool = False,
+    ) -> str:
         """Get converted image url by adapter.
 
         Args:
             original_image_url: links to images that needs to be converted
+            downloaded_path: local path of the image if it has been downloaded already
+            fetched: whether the concurrent download already tried this image, a
+                missing downloaded_path then means it failed and is not fetched again
 
         Returns:
             converted url
         """
-        if self.is_local_images:
+        if downloaded_path:
+            converted_image_path = downloaded_path
+        elif fetched:
+            raise Exception(
+                f"<{shorten_data_uri(original_image_url)}> download failed, no local image"
+            )
+        elif self.is_local_images and not is_data_uri(original_image_url):
             original_image_url = get_file_name_from_relative_path(original_image_url)
             converted_image_path = (
                 f"{self.image_local_storage_directory}/{original_image_url}"
             )
         else:
-            converted_image_path = _download_img(
-                self.image_local_storage_directory, original_image_url
-            )
+            started_at = time.perf_counter()
+            converted_image_path = self._fetch_image(original_image_url)
+            self._record_stage("download", started_at)
 
         if not converted_image_path:
             raise Exception("get a empty image path")
@@ -304,16 +441,18 @@ class BaseMdImageConverter(BaseModel):
             )
 
         # other adapter
+        started_at = time.perf_counter()
         with open(converted_image_path, "rb") as f:
             file_data = f.read()
             self.adapter.upload(image_name, file_data)
             converted_url = self.adapter.get_replaced_url(image_name)
             logger.debug(f"[imarkdown] converted image url: {converted_url}")
+        self._record_stage("upload", started_at)
         if not self.enable_save_images:
             os.remove(converted_image_path)
         if not converted_url:
             raise Exception(
-                f"<{original_image_url}> try to get new url but return None."
+                f"<{shorten_data_uri(original_image_url)}> try to get new url but return None."
             )
         return converted_url
 
@@ -325,7 +464,7 @@ class MdImageConverter:
         self.adapter = _load_default_adapter()
         if adapter:
             self.adapter: BaseMdAdapter = adapter
-            cfg.last_adapter_name = adapter.name
+            IMarkdownConfig().last_adapter_name = adapter.name
 
         self.converter: BaseMdImageConverter = BaseMdImageConverter(
             adapter=self.adapter
@@ -368,3 +507,4 @@ class MdImageConverter:
         for md_files in self.md_medium_manager.md_files:
             kwargs.update(**md_files.to_convert_params)
             self.converter.convert(**kwargs)
+        IMarkdownConfig().flush()
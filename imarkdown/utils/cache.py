@@ -1,12 +1,333 @@
-import tempfile
+"""Bounded key-value caches used by imarkdown.
+
+`Cache()` returns the process wide default cache, a `SQLiteCache` stored under the
+system temp directory. Any `BaseCache` implementation can be plugged in instead,
+see `IMarkdownConfig.use_cache`.
+"""
 
-from cushy_storage import CushyDict
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 from imarkdown.utils.singleton import singleton
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), "imarkdown")
+_LEGACY_CUSHY_DIRECTORY = f"{tempfile.gettempdir()}\\imarkdown"
+"""Old versions built the CushyDict path with a literal backslash."""
+
+_MISSING = object()
+
+
+def _encode(value: Any) -> Tuple[bytes, int]:
+    """Bytes are stored as is, everything else as JSON. Returns (data, is_json)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value), 0
+    return json.dumps(value, ensure_ascii=False).encode("utf-8"), 1
+
+
+def _decode(data: bytes, is_json: int) -> Any:
+    if is_json:
+        return json.loads(bytes(data).decode("utf-8"))
+    return bytes(data)
+
+
+class BaseCache(ABC):
+    """Interface of an imarkdown cache backend.
+
+    Values are JSON serializable objects or bytes. `ttl` is in seconds, None means
+    the entry never expires.
+    """
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the value of key, or default if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store value under key."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove key if it exists."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every entry."""
+
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        """Iterate over keys which have not expired."""
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Store several values. Backends should do it atomically when they can."""
+        for key, value in items.items():
+            self.set(key, value, ttl=ttl)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: str):
+        self.delete(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+
+class LRUMemoryCache(BaseCache):
+    """In-process cache with LRU eviction. Nothing is persisted."""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = 1024,
+        default_ttl: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while self.max_entries is not None and len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> Iterator[str]:
+        now = time.time()
+        with self._lock:
+            keys = [
+                key
+                for key, (_, expires_at) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+        return iter(keys)
+
+
+class SQLiteCache(BaseCache):
+    """Persistent cache backed by a single SQLite file.
+
+    The cache is bounded by `max_entries` and `max_bytes`; when a write goes over
+    either limit, expired entries are dropped first and then the least recently used
+    ones. The database runs in WAL mode and every write is its own transaction, so
+    several processes can share one cache file safely.
+    """
+
+    touch_interval = 60.0
+    """Seconds between LRU timestamp updates of an entry, so most reads stay read-only."""
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = 10000,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        default_ttl: Optional[float] = None,
+        timeout: float = 30.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, "
+                "value BLOB NOT NULL, "
+                "is_json INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "expires_at REAL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries(accessed_at)"
+            )
+        logger.debug(f"[imarkdown] sqlite cache initialized, path: {path}")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread and per process, connections must not cross a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT value, is_json, expires_at, accessed_at FROM entries WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return default
+        data, is_json, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            self.delete(key)
+            return default
+        if now - accessed_at >= self.touch_interval:
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ? AND accessed_at < ?",
+                (now, key, now - self.touch_interval),
+            )
+        return _decode(data, is_json)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.set_many({key: value}, ttl=ttl)
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        rows = []
+        for key, value in items.items():
+            data, is_json = _encode(value)
+            rows.append((key, data, is_json, len(data), expires_at, now))
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries "
+                "(key, value, is_json, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute(
+            "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now,),
+        )
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        over_entries = count - self.max_entries if self.max_entries is not None else 0
+        over_bytes = total - self.max_bytes if self.max_bytes is not None else 0
+        if over_entries <= 0 and over_bytes <= 0:
+            return
+
+        victims = []
+        freed = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at"
+        ):
+            if len(victims) >= over_entries and freed >= over_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        logger.debug(f"[imarkdown] sqlite cache evicted {len(victims)} entries")
+
+    def delete(self, key: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def keys(self) -> Iterator[str]:
+        rows = self._conn.execute(
+            "SELECT key FROM entries WHERE expires_at IS NULL OR expires_at > ?",
+            (time.time(),),
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return len(list(self.keys()))
+
+
+def _migrate_legacy_cache(cache: BaseCache):
+    """Copy entries of the old CushyDict cache, like cached adapter parameters, into
+    the new cache once."""
+    if not os.path.isdir(_LEGACY_CUSHY_DIRECTORY) or "__migrated__" in cache:
+        return
+    try:
+        from cushy_storage import CushyDict
+    except ImportError:
+        return
+    try:
+        legacy = CushyDict(_LEGACY_CUSHY_DIRECTORY)
+        items = {}
+        for prefix in os.listdir(_LEGACY_CUSHY_DIRECTORY):
+            prefix_path = os.path.join(_LEGACY_CUSHY_DIRECTORY, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for name in os.listdir(prefix_path):
+                if name.endswith("_"):
+                    key = prefix + name[:-1]
+                    items[key] = legacy[key]
+        cache.set_many(items)
+        cache.set("__migrated__", True)
+        logger.info(f"[imarkdown] migrated {len(items)} legacy cache entries")
+    except Exception as e:
+        logger.warning(f"[imarkdown] migrate legacy cache failed, reason: {e}")
+
 
 @singleton()
-class Cache(CushyDict):
+class Cache(SQLiteCache):
+    """Default imarkdown cache shared by config and anything else that needs it."""
+
     def __init__(self):
-        self.cache_path = f"{tempfile.gettempdir()}\imarkdown"
+        self.cache_path = os.path.join(DEFAULT_CACHE_DIRECTORY, "cache.sqlite3")
         super().__init__(self.cache_path)
+        _migrate_legacy_cache(self)
@@ -0,0 +1,121 @@
+"""Inline `data:` URI images.
+
+Markdown pasted from some editors embeds images as `data:image/png;base64,...`, often
+several megabytes on a single line. The scanner finds them with `str.find` and one
+anchored character class match per URI, so every blob is read once and no pattern ever
+backtracks over it. `mask_data_uris` swaps each blob for a short placeholder, which lets
+the usual image link regular expressions run on a small text.
+
+Payloads wrapped over several lines are accepted when the wrapped URI is closed like a
+link target (`)`, a quote or `>`), as is the URL-safe base64 alphabet.
+"""
+
+import binascii
+import re
+from typing import List, Tuple
+
+DATA_URI_PREFIX = "data:image/"
+
+_HEADER_MAX_LENGTH = 128
+"""Longest accepted `data:image/<type>[;param...];base64,` header."""
+_HEADER = re.compile(r"data:image/([A-Za-z0-9.+-]+)(?:;[A-Za-z0-9=._+-]+)*;base64,")
+_PAYLOAD = re.compile(r"[A-Za-z0-9+/=_-]*")
+# the character classes are disjoint, every character has exactly one way to match
+_WRAPPED_PAYLOAD = re.compile(r"[A-Za-z0-9+/=_-]*(?:\s+[A-Za-z0-9+/=_-]+)*")
+_LINK_END = re.compile(r"\s*[)\"'>]")
+_WHITESPACE = re.compile(r"\s")
+_URLSAFE = str.maketrans("-_", "+/")
+_PLACEHOLDER = re.compile("\0data-uri-(\\d+)\0")
+
+_EXTENSIONS = {"jpeg": ".jpg", "svg+xml": ".svg", "x-icon": ".ico"}
+
+
+def is_data_uri(url: str) -> bool:
+    return url.startswith(DATA_URI_PREFIX)
+
+
+def find_data_uris(text: str) -> List[Tuple[int, int]]:
+    """Return (start, end) of every base64 image data URI in text."""
+    spans = []
+    pos = text.find(DATA_URI_PREFIX)
+    while pos != -1:
+        header = _HEADER.match(text, pos, pos + _HEADER_MAX_LENGTH)
+        if header:
+            end = _PAYLOAD.match(text, header.end()).end()
+            wrapped = _WRAPPED_PAYLOAD.match(text, end).end()
+            if wrapped > end and _LINK_END.match(text, wrapped):
+                end = wrapped
+            if end > header.end():
+                spans.append((pos, end))
+                pos = end - 1
+        pos = text.find(DATA_URI_PREFIX, pos + 1)
+    return spans
+
+
+def mask_data_uris(text: str) -> Tuple[str, List[str]]:
+    """Replace every data URI by a placeholder, return the new text and the URIs.
+
+    Use `unmask_data_uris` to turn placeholders found in the masked text back into
+    the original URIs.
+    """
+    spans = find_data_uris(text)
+    if not spans:
+        return text, []
+    parts = []
+    uris = []
+    last = 0
+    for i, (start, end) in enumerate(spans):
+        parts.append(text[last:start])
+        parts.append(f"\0data-uri-{i}\0")
+        uris.append(text[start:end])
+        last = end
+    parts.append(text[last:])
+    return "".join(parts), uris
+
+
+def unmask_data_uris(value: str, uris: List[str]) -> str:
+    if not uris or "\0" not in value:
+        return value
+    return _PLACEHOLDER.sub(lambda match: uris[int(match.group(1))], value)
+
+
+def decode_data_uri(uri: str) -> bytes:
+    """Decode the base64 payload of a data URI.
+
+    The payload str goes to the decoder as is, without being encoded to bytes first.
+    Whitespace from wrapped lines, the URL-safe alphabet and missing padding are
+    tolerated.
+    """
+    comma = uri.find(",", 0, _HEADER_MAX_LENGTH)
+    if not is_data_uri(uri) or comma == -1:
+        raise ValueError("not a base64 image data URI")
+    payload = uri[comma + 1 :]
+    if _WHITESPACE.search(payload):
+        payload = "".join(payload.split())
+    if "-" in payload or "_" in payload:
+        payload = payload.translate(_URLSAFE)
+    padding = -len(payload.rstrip("=")) % 4
+    if padding:
+        payload = payload.rstrip("=") + "=" * padding
+    try:
+        data = binascii.a2b_base64(payload)
+    except binascii.Error as e:
+        raise ValueError(f"invalid base64 image data URI: {e}") from e
+    if not data:
+        raise ValueError("empty image data URI")
+    return data
+
+
+def data_uri_extension(uri: str) -> str:
+    """File extension matching the media type of a data URI, like `.png`."""
+    header = _HEADER.match(uri, 0, _HEADER_MAX_LENGTH)
+    subtype = header.group(1).lower() if header else "png"
+    return _EXTENSIONS.get(subtype, f".{subtype}")
+
+
+def shorten_data_uri(url: str) -> str:
+    """Readable form of url for logs and reports, data URIs are cut after the header."""
+    if not is_data_uri(url):
+        return url
+    comma = url.find(",", 0, _HEADER_MAX_LENGTH)
+    return f"{url[:comma + 1]}...({len(url)} chars)"
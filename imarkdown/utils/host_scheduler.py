@@ -0,0 +1,195 @@
+"""Politeness scheduling for remote image fetches.
+
+Every request takes a slot from a `HostScheduler` before it is sent. A slot is only
+granted when the host has fewer than `per_host` requests in flight, fewer than
+`max_total` requests are in flight overall, and the host is not backing off after a
+429 or 503. When several requests wait for a free global slot, the one whose host has
+the fewest requests in flight goes first, so requests interleave across hosts and a
+slow host cannot starve the others.
+
+`get_host_scheduler()` returns the process wide scheduler shared by imarkdown and the
+desktop converter.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUS_CODES = (429, 503)
+"""Status codes which make a host back off."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header, None if it is missing."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Ticket:
+    def __init__(self, host: str, seq: int):
+        self.host = host
+        self.seq = seq
+
+
+class HostScheduler:
+    """Per-host and global concurrency caps with host-level backoff."""
+
+    def __init__(
+        self,
+        per_host: int = 4,
+        max_total: int = 16,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.per_host = per_host
+        self.max_total = max_total
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._active: Dict[str, int] = {}
+        self._total = 0
+        self._waiting: List[_Ticket] = []
+        self._seq = itertools.count()
+        self._backoff_until: Dict[str, float] = {}
+        self._strikes: Dict[str, int] = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Hold a request slot for url while the body of the with statement runs."""
+        host = self.host_of(url)
+        with self._cond:
+            ticket = _Ticket(host, next(self._seq))
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    wait = self._wait_seconds(ticket)
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+            self._active[host] = self._active.get(host, 0) + 1
+            self._total += 1
+            if self._waiting:
+                # the next waiting request in line may be a different one now
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[host] -= 1
+                if not self._active[host]:
+                    del self._active[host]
+                self._total -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def extra_slots(self, url: str, wanted: int) -> Iterator[int]:
+        """Take up to `wanted` more slots for url without waiting, yield how many.
+
+        Meant for a request which already holds a slot and could split its work over
+        more connections, like a segmented download. Nothing is granted while other
+        requests wait or the host backs off.
+        """
+        host = self.host_of(url)
+        with self._cond:
+            granted = 0
+            if (
+                wanted > 0
+                and not self._waiting
+                and self._backoff_until.get(host, 0.0) <= time.monotonic()
+            ):
+                granted = min(
+                    wanted,
+                    self.per_host - self._active.get(host, 0),
+                    self.max_total - self._total,
+                )
+                granted = max(0, granted)
+            if granted:
+                self._active[host] = self._active.get(host, 0) + granted
+                self._total += granted
+        try:
+            yield granted
+        finally:
+            if granted:
+                with self._cond:
+                    self._active[host] -= granted
+                    if not self._active[host]:
+                        del self._active[host]
+                    self._total -= granted
+                    self._cond.notify_all()
+
+    def _wait_seconds(self, ticket: _Ticket) -> Optional[float]:
+        """0 when ticket may start now, otherwise how long to wait (None until notified)."""
+        backoff = self._backoff_until.get(ticket.host, 0.0) - time.monotonic()
+        if backoff > 0:
+            return backoff
+        if self._active.get(ticket.host, 0) >= self.per_host:
+            return None
+        if self._total >= self.max_total:
+            return None
+        # Among waiting requests which could start, serve the least busy host first,
+        # then the oldest request.
+        now = time.monotonic()
+        candidates = [
+            t
+            for t in self._waiting
+            if self._active.get(t.host, 0) < self.per_host
+            and self._backoff_until.get(t.host, 0.0) <= now
+        ]
+        best = min(candidates, key=lambda t: (self._active.get(t.host, 0), t.seq))
+        return 0 if best is ticket else None
+
+    def report(self, url: str, status_code: int, retry_after: Optional[str] = None):
+        """Record the response status of a request to url.
+
+        A 429 or 503 makes the host back off, exponentially on repeated throttling
+        unless the server sent Retry-After. Any other status resets the backoff.
+        """
+        host = self.host_of(url)
+        with self._cond:
+            if status_code not in THROTTLE_STATUS_CODES:
+                self._strikes.pop(host, None)
+                return
+            strikes = self._strikes.get(host, 0) + 1
+            self._strikes[host] = strikes
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = self.base_backoff * 2 ** (strikes - 1)
+            delay = min(delay, self.max_backoff)
+            self._backoff_until[host] = time.monotonic() + delay
+            logger.info(
+                f"[imarkdown] <{host}> answered {status_code}, backing off {delay:.1f}s"
+            )
+            self._cond.notify_all()
+
+
+_scheduler: Optional[HostScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_host_scheduler() -> HostScheduler:
+    """Process wide scheduler shared by every remote image fetch."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = HostScheduler()
+        return _scheduler
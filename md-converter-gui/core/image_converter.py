@@ -4,17 +4,35 @@
 图片转换核心模块 - 集成imarkdown和WebP转换功能
 """
 
+import atexit
+import hashlib
+import html
+import io
+import math
+import multiprocessing
 import os
+import queue
 import random
 import re
 import sys
 import tempfile
+import threading
 import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple, Union
 
 import requests
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
+
+try:
+    import numpy as np
+except ImportError:  # 仅 SSIM 目标需要 numpy
+    np = None
 
 # 添加imarkdown路径到系统路径
 current_dir = Path(__file__).parent.parent.parent
@@ -30,77 +48,1149 @@ except ImportError:
     LocalFileAdapter = None
     MdFile = None
 
+try:
+    from imarkdown.utils.host_scheduler import (
+        THROTTLE_STATUS_CODES,
+        get_host_scheduler,
+    )
+except ImportError:  # 没有 imarkdown 时不限制并发，也不做主机级退避
+    THROTTLE_STATUS_CODES = (429, 503)
+    get_host_scheduler = None
+
+try:
+    from imarkdown.utils.data_uri import (
+        decode_data_uri,
+        is_data_uri,
+        mask_data_uris,
+        shorten_data_uri,
+        unmask_data_uris,
+    )
+except ImportError:  # 没有 imarkdown 时不提取内联的 data URI 图片
+    decode_data_uri = None
+    mask_data_uris = None
+
+    def is_data_uri(url: str) -> bool:
+        return url.startswith("data:image/")
+
+    def shorten_data_uri(url: str) -> str:
+        return url[:64] + "..." if is_data_uri(url) else url
+
+
+# 编码进程池：按进程数缓存复用，避免每次转换都重新拉起子进程
+_ENCODE_POOLS: Dict[int, ProcessPoolExecutor] = {}
+_ENCODE_POOLS_LOCK = threading.Lock()
+
+
+def default_encode_workers() -> int:
+    """默认编码进程数：与 CPU 核数一致"""
+    return max(1, os.cpu_count() or 1)
+
+
+def _get_encode_pool(workers: int) -> ProcessPoolExecutor:
+    """获取（或创建）指定大小的编码进程池"""
+    with _ENCODE_POOLS_LOCK:
+        pool = _ENCODE_POOLS.get(workers)
+        if pool is None:
+            # 统一使用 spawn：GUI 在 QThread 中调用，fork 多线程进程不安全
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _ENCODE_POOLS[workers] = pool
+        return pool
+
+
+def _discard_encode_pool(workers: int):
+    with _ENCODE_POOLS_LOCK:
+        pool = _ENCODE_POOLS.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+@atexit.register
+def shutdown_encode_pools():
+    """关闭所有编码进程池"""
+    for workers in list(_ENCODE_POOLS):
+        pool = _ENCODE_POOLS.pop(workers)
+        pool.shutdown(wait=False)
+
+
+class MemoryBudget:
+    """
+    解码/编码内存预算：按解码前估算的字节数准入任务
+
+    预算内的任务并发执行；单个任务超过预算时等其它任务全部结束后独占执行，
+    因此超大图片之间天然串行。同一进程内的所有转换共用一个预算。
+    """
+
+    def __init__(self, limit_bytes: Optional[int]):
+        # None 或 0 表示不限制
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self._active = 0
+        self._waiting: Deque[object] = deque()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        with self._cond:
+            # 按到达顺序准入，避免大任务被源源不断的小任务饿死
+            ticket = object()
+            self._waiting.append(ticket)
+            while self._waiting[0] is not ticket or (
+                self.limit_bytes
+                and self._active
+                and self.in_use + nbytes > self.limit_bytes
+            ):
+                self._cond.wait()
+            self._waiting.popleft()
+            self.in_use += nbytes
+            self._active += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                self._active -= 1
+                self._cond.notify_all()
+
+
+def _env_int(name: str) -> Optional[int]:
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return None
+
+
+# 默认 512MB，可用环境变量 PICGOMD_MEMORY_BUDGET_MB 调整（0 表示不限制）
+_budget_mb = _env_int("PICGOMD_MEMORY_BUDGET_MB")
+DECODE_MEMORY_BUDGET = MemoryBudget((512 if _budget_mb is None else _budget_mb) << 20)
+
+# 解压炸弹上限（像素数），环境变量同时作用于 spawn 出的编码子进程
+if _env_int("PICGOMD_MAX_IMAGE_PIXELS") is not None:
+    Image.MAX_IMAGE_PIXELS = _env_int("PICGOMD_MAX_IMAGE_PIXELS") or None
+
+
+def configure_image_limits(
+    memory_budget_bytes: Optional[int] = None,
+    max_image_pixels: Optional[int] = None,
+):
+    """
+    调整图片处理的资源上限
+
+    Args:
+        memory_budget_bytes: 同时解码/编码的内存预算(bytes)，0 表示不限制
+        max_image_pixels: 单张图片最大像素数，超过 2 倍时 Pillow 拒绝解码，0 表示不限制
+    """
+    if memory_budget_bytes is not None:
+        DECODE_MEMORY_BUDGET.limit_bytes = memory_budget_bytes
+    if max_image_pixels is not None:
+        Image.MAX_IMAGE_PIXELS = max_image_pixels or None
+        # 编码子进程以 spawn 启动，通过环境变量继承该设置
+        os.environ["PICGOMD_MAX_IMAGE_PIXELS"] = str(max_image_pixels)
+
+
+# 编码结果缓存：按 (源图内容哈希, 编码参数) 保存编码后的字节，GUI 与后端共用同一文件
+ENCODE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# 编码逻辑变化导致旧结果不再适用时递增
+ENCODE_CACHE_VERSION = 1
+_ENCODE_CACHE = None
+_ENCODE_CACHE_LOCK = threading.Lock()
+# 网络图片的 HTTP 缓存：保存响应体与 ETag / Last-Modified，下次下载时条件请求
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_HTTP_CACHE = None
+
+
+def _open_sqlite_cache(filename: str, max_bytes: int):
+    """在 imarkdown 缓存目录下打开 SQLiteCache（LRU 且受总大小限制），失败时返回 False"""
+    try:
+        from imarkdown.utils.cache import DEFAULT_CACHE_DIRECTORY, SQLiteCache
+
+        return SQLiteCache(
+            os.path.join(DEFAULT_CACHE_DIRECTORY, filename),
+            max_entries=None,
+            max_bytes=max_bytes,
+        )
+    except Exception as e:
+        print(f"Warning: 缓存 {filename} 不可用: {e}")
+        return False
+
+
+def get_encode_cache():
+    """获取编码结果缓存，不可用时返回 None"""
+    global _ENCODE_CACHE
+    with _ENCODE_CACHE_LOCK:
+        if _ENCODE_CACHE is None:
+            _ENCODE_CACHE = _open_sqlite_cache(
+                "webp_encode_cache.sqlite3", ENCODE_CACHE_MAX_BYTES
+            )
+        # 注意空缓存的 len 为 0，不能用真值判断
+        return _ENCODE_CACHE if _ENCODE_CACHE is not False else None
+
+
+def get_http_cache():
+    """获取网络图片的 HTTP 缓存，不可用时返回 None"""
+    global _HTTP_CACHE
+    with _ENCODE_CACHE_LOCK:
+        if _HTTP_CACHE is None:
+            _HTTP_CACHE = _open_sqlite_cache("http_cache.sqlite3", HTTP_CACHE_MAX_BYTES)
+        return _HTTP_CACHE if _HTTP_CACHE is not False else None
+
+
+def clear_encode_cache():
+    """清空编码结果缓存"""
+    cache = get_encode_cache()
+    if cache is not None:
+        cache.clear()
+
+
+# 质量搜索结果缓存：(内容哈希, 目标) -> quality，同一图片同一目标只搜索一次
+_QUALITY_CACHE: "OrderedDict[Tuple, int]" = OrderedDict()
+_QUALITY_CACHE_LOCK = threading.Lock()
+_QUALITY_CACHE_SIZE = 4096
+
+
+def _psnr(original: Image.Image, encoded: Image.Image) -> float:
+    """峰值信噪比(dB)，数值越大越接近原图"""
+    stat = ImageStat.Stat(ImageChops.difference(original, encoded))
+    mse = sum(rms * rms for rms in stat.rms) / len(stat.rms)
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255 * 255 / mse)
+
+
+def _box_mean(values, size: int):
+    """size x size 窗口均值（积分图实现，只保留完整窗口）"""
+    integral = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = (
+        integral[size:, size:]
+        - integral[:-size, size:]
+        - integral[size:, :-size]
+        + integral[:-size, :-size]
+    )
+    return total / (size * size)
+
+
+def _ssim(original: Image.Image, encoded: Image.Image) -> float:
+    """灰度结构相似度(SSIM)，7x7 均值窗口，取值 0~1"""
+    x = np.asarray(original.convert("L"), dtype=np.float64)
+    y = np.asarray(encoded.convert("L"), dtype=np.float64)
+    size = max(1, min(7, *x.shape))
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    mu_x = _box_mean(x, size)
+    mu_y = _box_mean(y, size)
+    var_x = _box_mean(x * x, size) - mu_x * mu_x
+    var_y = _box_mean(y * y, size) - mu_y * mu_y
+    cov = _box_mean(x * y, size) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / (
+        (mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2)
+    )
+    return float(ssim_map.mean())
+
+
+def _first_quality(lo: int, hi: int, predicate: Callable[[int], bool]) -> int:
+    """二分查找 [lo, hi] 中第一个满足 predicate 的质量（predicate 随质量单调），
+    都不满足时返回 hi + 1"""
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if predicate(mid):
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    return lo
+
+
+class ImageEncoder(ABC):
+    """
+    编码器后端：把解码后的图片保存为某种格式
+
+    子类给出 Pillow 的格式名与扩展名，并把统一的 quality 与 method (0~6，越大越慢、越小)
+    换算为各自的保存参数
+    """
+
+    name = ""
+    format = ""
+    extension = ""
+
+    def available(self) -> bool:
+        """当前安装的 Pillow 能否保存该格式"""
+        Image.init()
+        return self.format in Image.SAVE
+
+    @abstractmethod
+    def save_kwargs(self, quality: int, method: int, alpha_quality: int = 100) -> dict:
+        """有损编码的保存参数"""
+
+    def lossless_kwargs(self, method: int, effort: int) -> Optional[dict]:
+        """无损编码参数，不支持无损时返回 None"""
+        return None
+
+
+class WebPEncoder(ImageEncoder):
+    name = "webp"
+    format = "WEBP"
+    extension = ".webp"
+
+    def save_kwargs(self, quality: int, method: int, alpha_quality: int = 100) -> dict:
+        # 根据质量设置选择不同的压缩策略
+        save_kwargs = {
+            "format": self.format,
+            "quality": quality,
+            "optimize": True,
+            "method": method,
+            "alpha_quality": alpha_quality,
+        }
+
+        # 低质量时使用更激进的压缩
+        if quality < 50:
+            save_kwargs["lossless"] = False
+        elif quality > 90:
+            # 高质量时保持更多细节
+            save_kwargs["method"] = min(method, 4)
+        return save_kwargs
+
+    def lossless_kwargs(self, method: int, effort: int) -> Optional[dict]:
+        # Pillow 中 lossless 时 quality 表示压缩强度
+        return {
+            "format": self.format,
+            "lossless": True,
+            "quality": effort,
+            "method": method,
+        }
+
+
+class AvifEncoder(ImageEncoder):
+    """AVIF，需要 Pillow 11.2 及以上且编译了 libavif"""
+
+    name = "avif"
+    format = "AVIF"
+    extension = ".avif"
+
+    def save_kwargs(self, quality: int, method: int, alpha_quality: int = 100) -> dict:
+        # speed 0~10 越小越慢；低于 6 时耗时成倍增长而体积收益很小，因此不低于 6
+        return {"format": self.format, "quality": quality, "speed": 10 - min(method, 4)}
+
+
+class JpegXLEncoder(ImageEncoder):
+    """JPEG XL，Pillow 本身不支持，需要安装 pillow-jxl-plugin"""
+
+    name = "jxl"
+    format = "JXL"
+    extension = ".jxl"
+
+    def available(self) -> bool:
+        try:
+            import pillow_jxl  # noqa: F401  导入时向 Pillow 注册 JXL 格式
+        except ImportError:
+            return False
+        return super().available()
+
+    def save_kwargs(self, quality: int, method: int, alpha_quality: int = 100) -> dict:
+        # effort 1~9，越大越慢
+        return {"format": self.format, "quality": quality, "effort": method + 1}
+
+    def lossless_kwargs(self, method: int, effort: int) -> Optional[dict]:
+        return {"format": self.format, "lossless": True, "effort": method + 1}
+
+
+# 可选的编码器后端，按名称选择
+ENCODERS: Dict[str, ImageEncoder] = {
+    encoder.name: encoder for encoder in (WebPEncoder(), AvifEncoder(), JpegXLEncoder())
+}
+
+
+def available_encoders() -> List[str]:
+    """当前环境可用的编码器名称"""
+    return [name for name, encoder in ENCODERS.items() if encoder.available()]
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    """图片是否带透明信息（alpha 通道或调色板透明色）"""
+    if img.mode in ("RGBA", "LA", "PA", "RGBa", "La"):
+        return True
+    return img.mode == "P" and "transparency" in img.info
+
 
 class WebPConverter:
     """WebP转换器"""
 
-    def __init__(self, quality: int = 80):
+    # 下载内容超过该大小时改为写入临时文件，避免大图长期占用内存
+    DEFAULT_SPILL_THRESHOLD = 8 * 1024 * 1024
+    # 最大下载大小，防止超大图阻塞
+    MAX_DOWNLOAD_BYTES = 15 * 1024 * 1024
+    # 下载时先用开头的字节解析文件头（格式、宽高），不够时加倍，最多读到 PROBE_MAX_BYTES
+    PROBE_BYTES = 16 * 1024
+    PROBE_MAX_BYTES = 256 * 1024
+    # 连接中断后按 Range 从已收到的位置续传的次数与退避间隔(秒)
+    DOWNLOAD_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+    # 分段并行下载时每段的最小字节数，更小的图片单连接下载
+    SEGMENT_MIN_BYTES = 2 * 1024 * 1024
+
+    # 各 method 的编码耗时估计(秒/百万像素)，用于在时间预算内选择 method
+    METHOD_COST = (0.04, 0.04, 0.05, 0.11, 0.11, 0.13, 0.19)
+    # effort 为 auto 时按像素数封顶：(最大像素数, method)，更大的图使用 method 2
+    EFFORT_PIXEL_STEPS = ((2_000_000, 6), (12_000_000, 4))
+    # 可以原样保留的格式及其扩展名（浏览器均可直接显示）
+    PASSTHROUGH_FORMATS = {
+        "WEBP": ".webp",
+        "JPEG": ".jpg",
+        "PNG": ".png",
+        "GIF": ".gif",
+    }
+    # 每像素比特数不超过该值的 WebP 视为已充分压缩，不再解码
+    PASSTHROUGH_WEBP_BPP = 1.0
+    # 目标模式下质量搜索的范围与探测图最长边
+    QUALITY_SEARCH_RANGE = (10, 95)
+    PROBE_SIZE = 512
+    # lossless 为 auto 时，缩略图颜色数不超过该值（截图、图表）才额外尝试无损编码
+    LOSSLESS_MAX_COLORS = 1024
+    LOSSLESS_SAMPLE_SIZE = 256
+    # 无损编码的压缩强度（Pillow 中 lossless 时 quality 表示强度）
+    LOSSLESS_EFFORT = 80
+
+    def __init__(
+        self,
+        quality: int = 80,
+        spill_threshold: Optional[int] = None,
+        target_bytes: Optional[int] = None,
+        min_ssim: Optional[float] = None,
+        min_psnr: Optional[float] = None,
+        effort: Union[str, int] = "auto",
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None,
+        use_cache: bool = True,
+        animated: bool = True,
+        max_frames: Optional[int] = None,
+        max_fps: Optional[float] = None,
+        keep_alpha: bool = False,
+        alpha_quality: int = 100,
+        lossless: Union[str, bool] = "auto",
+        srcset_widths: Optional[Tuple[int, ...]] = None,
+        encoder: Union[str, Sequence[str]] = "webp",
+        download_segments: int = 1,
+    ):
+        """
+        Args:
+            quality: 固定质量；设置任一目标后改为逐图搜索质量
+            spill_threshold: 下载超过该字节数时落盘
+            target_bytes: 单张图片的体积预算(bytes)
+            min_ssim: 最低 SSIM (0~1)，需要 numpy
+            min_psnr: 最低 PSNR (dB)
+            effort: 编码强度，"auto" 按像素数与时间预算自适应，"max" 固定 method 6，
+                或 0~6 的整数
+            max_width: 最大宽度，超出时等比缩小（JPEG 使用 draft 缩小解码）
+            max_height: 最大高度，超出时等比缩小
+            use_cache: 是否使用磁盘上的编码结果缓存
+            animated: 动图（GIF / APNG）是否编码为动态 WebP，False 时只保留首帧
+            max_frames: 动图最多保留的帧数，超出时均匀抽帧
+            max_fps: 动图最高帧率，过密的帧被合并
+            keep_alpha: 透明图片保留透明通道；默认 False，与旧版一样铺白底后按 RGB 编码
+            alpha_quality: 透明通道的压缩质量 (0~100)
+            lossless: "auto" 时颜色少的图片同时做有损与无损编码并保留较小者，
+                True 始终无损编码，False 始终有损编码
+            srcset_widths: 响应式图片的宽度档位，例如 (480, 960, 1920)；
+                小于主图宽度的档位从同一次解码逐级缩小得到，结果放在 info["variants"]
+            encoder: 静态图片的编码器，"webp"、"avif"、"jxl"，见 available_encoders()；
+                传入多个时每张图片分别编码并保留最小的一份。配合 min_ssim / min_psnr
+                时各编码器先各自搜索到满足画质下限的质量，即"画质达标时取最小"。
+                动图始终编码为 WebP
+            download_segments: 大图（支持 Range 且有 ETag / Last-Modified）拆成几段并行下载
+        """
         self.quality = quality
+        self.spill_threshold = (
+            self.DEFAULT_SPILL_THRESHOLD if spill_threshold is None else spill_threshold
+        )
+        self.target_bytes = target_bytes
+        self.min_ssim = min_ssim
+        self.min_psnr = min_psnr
+        if effort not in ("auto", "max") and not (
+            isinstance(effort, int)
+            and not isinstance(effort, bool)
+            and 0 <= effort <= 6
+        ):
+            raise ValueError(
+                f'effort 应为 "auto"、"max" 或 0~6 的整数，收到 {effort!r}'
+            )
+        self.effort = effort
+        self.max_width = max_width
+        self.max_height = max_height
+        self.use_cache = use_cache
+        self.animated = animated
+        self.max_frames = max_frames
+        self.max_fps = max_fps
+        self.keep_alpha = keep_alpha
+        self.alpha_quality = alpha_quality
+        self.lossless = lossless
+        self.srcset_widths = tuple(sorted(set(srcset_widths or ()), reverse=True))
+        names = (encoder,) if isinstance(encoder, str) else tuple(encoder)
+        self.encoders = tuple(
+            name for name in names if name in ENCODERS and ENCODERS[name].available()
+        )
+        if len(self.encoders) != len(names):
+            print(f"Warning: 编码器不可用，已忽略: {set(names) - set(self.encoders)}")
+        if not self.encoders:
+            self.encoders = ("webp",)
+        self.download_segments = max(1, download_segments)
+        if min_ssim and np is None:
+            print("Warning: numpy 未安装，忽略 SSIM 目标")
+            self.min_ssim = None
 
     def set_quality(self, quality: int):
         """设置WebP质量"""
         self.quality = max(1, min(100, quality))
 
-    def convert_to_webp(
-        self, input_path: str, output_path: str
-    ) -> Tuple[bool, int, int]:
+    def encode_webp(
+        self, source: Union[str, bytes], time_budget: Optional[float] = None
+    ) -> bytes:
         """
-        将图片转换为WebP格式
+        将图片编码为WebP，全程在内存中完成
+
+        Args:
+            source: 图片文件路径，或已下载到内存中的图片字节
+            time_budget: 本张图片可用的编码时间(秒)，effort 为 auto 时参与选择 method
 
         Returns:
-            Tuple[成功状态, 原始文件大小(bytes), 转换后文件大小(bytes)]
+            WebP 图片字节
         """
-        try:
-            # 获取原始文件大小
-            original_size = os.path.getsize(input_path)
+        return self.encode_webp_detailed(source, time_budget)[0]
+
+    def encode_webp_detailed(
+        self,
+        source: Union[str, bytes],
+        time_budget: Optional[float] = None,
+        passthrough: bool = False,
+    ) -> Tuple[bytes, dict]:
+        """
+        同 encode_webp，额外返回编码信息：
+        width、height、quality、method、encode_seconds、passthrough、extension；
+        decode_seconds 为其中的解码耗时（动图边解码边编码，不单独统计）；
+        设置 srcset_widths 时 variants 为各宽度档位的 width、height、mode、data
+
+        Args:
+            passthrough: 为 True 时，已是足够小的 WebP 不解码直接保留原图；
+                重新编码反而变大的网页常用格式也保留原图。
+                此时返回原始字节，extension 为原格式扩展名
+
+        启用 use_cache 时先按 (内容哈希, 编码参数) 查询编码结果缓存，命中时 cache_hit 为 True
+        """
+        started_at = time.perf_counter()
+        cache = get_encode_cache() if self.use_cache else None
+        digest = None
+        if self.has_target or cache is not None:
+            digest = self._content_digest(source)
+
+        cache_key = None
+        if cache is not None:
+            cache_key = self._encode_cache_key(digest, passthrough)
+            try:
+                info = cache.get(f"{cache_key}:info")
+                data = cache.get(cache_key) if info else None
+                for i, variant in enumerate(info.get("variants", []) if data else []):
+                    variant["data"] = cache.get(f"{cache_key}:{i}")
+                    if variant["data"] is None:
+                        data = None
+            except Exception as e:
+                print(f"读取编码缓存失败: {e}")
+                data = None
+            if data is not None:
+                info["encode_seconds"] = time.perf_counter() - started_at
+                info["decode_seconds"] = 0.0
+                info["cache_hit"] = True
+                return data, info
+
+        data, info = self._encode(source, digest, time_budget, passthrough, started_at)
+        info["cache_hit"] = False
+        # 时间预算压低了 method 的结果不写入缓存，避免之后不赶时间的转换也拿到它；
+        # 反过来，有预算的转换可以直接使用缓存中更充分的结果
+        budget_limited = info.pop("budget_limited", False)
+        if cache_key is not None and not budget_limited:
+            # 各档位的字节单独存放，info 只保存可 JSON 序列化的部分
+            entries = {cache_key: data}
+            variants = info.get("variants", [])
+            for i, variant in enumerate(variants):
+                entries[f"{cache_key}:{i}"] = variant["data"]
+            entries[f"{cache_key}:info"] = dict(
+                info,
+                variants=[
+                    {k: v for k, v in variant.items() if k != "data"}
+                    for variant in variants
+                ],
+            )
+            try:
+                cache.set_many(entries)
+            except Exception as e:
+                print(f"写入编码缓存失败: {e}")
+        return data, info
+
+    def _encode_cache_key(self, digest: str, passthrough: bool) -> str:
+        params = (
+            ENCODE_CACHE_VERSION,
+            self.quality,
+            self.effort,
+            self._target_key(),
+            passthrough,
+            (self.animated, self.max_frames, self.max_fps),
+            (self.keep_alpha, self.alpha_quality),
+            self.lossless,
+            self.srcset_widths,
+            self.encoders,
+        )
+        return f"webp:{digest}:{hashlib.sha1(repr(params).encode()).hexdigest()}"
 
-            with Image.open(input_path) as img:
-                # 如果是RGBA模式，转换为RGB
-                if img.mode == "RGBA":
-                    # 创建白色背景
-                    background = Image.new("RGB", img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1])  # 使用alpha通道作为mask
-                    img = background
-                elif img.mode not in ("RGB", "L"):
+    def _encode(
+        self,
+        source: Union[str, bytes],
+        digest: Optional[str],
+        time_budget: Optional[float],
+        passthrough: bool,
+        started_at: float,
+    ) -> Tuple[bytes, dict]:
+        original_size = source_size(source)
+        stream = source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            stream = io.BytesIO(source)
+
+        with Image.open(stream) as img:
+            # Image.open 只解析文件头，此时尚未解码像素
+            width, height = img.size
+            target_size = self.target_size(width, height)
+            extension = (
+                self.PASSTHROUGH_FORMATS.get(img.format) if passthrough else None
+            )
+            # 需要更小的响应式档位时必须解码，不能直接保留原图
+            needs_variants = any(w < width for w in self.srcset_widths)
+            if (
+                extension
+                and not needs_variants
+                and self._is_already_optimal(img, original_size, target_size)
+            ):
+                return self._passthrough(source, width, height, extension, started_at)
+            if self.animated and getattr(img, "n_frames", 1) > 1:
+                data, info = self._encode_animation(img, target_size, time_budget)
+                if extension and not target_size and len(data) >= original_size:
+                    return self._passthrough(
+                        source, width, height, extension, started_at
+                    )
+                info["encode_seconds"] = time.perf_counter() - started_at
+                return data, info
+            if target_size:
+                # JPEG 直接按 1/2、1/4、1/8 缩小解码，解码内存与耗时随像素数下降
+                img.draft(img.mode, target_size)
+            # 显式解码，单独统计解码耗时（否则解码发生在首次访问像素时）
+            decode_started = time.perf_counter()
+            img.load()
+            decode_seconds = time.perf_counter() - decode_started
+
+            if self.keep_alpha and _has_alpha(img):
+                # WebP 原生支持透明通道，直接编码 RGBA，无需铺白底
+                if img.mode != "RGBA":
+                    img = img.convert("RGBA")
+                if img.getchannel("A").getextrema() == (255, 255):
+                    # alpha 通道完全不透明，丢弃后按 RGB 编码
                     img = img.convert("RGB")
+            # 如果是RGBA模式，转换为RGB
+            elif img.mode == "RGBA":
+                # 创建白色背景
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])  # 使用alpha通道作为mask
+                img = background
+            elif img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            if target_size and img.size != target_size:
+                # draft 只能粗略缩小，最终尺寸用高质量重采样得到
+                img = img.resize(target_size, Image.LANCZOS)
+
+            method = self.choose_method(img.width * img.height, time_budget)
+            budget_limited = method < self.choose_method(img.width * img.height)
+            best = None
+            for encoder in self.encoders:
+                quality = self.quality
+                if self.has_target:
+                    quality = self.choose_quality(img, digest, method, encoder)
+                save_kwargs = self._save_kwargs(quality, method, encoder)
+                buffer, lossless = self._encode_still(img, save_kwargs, encoder)
+                if best is None or buffer.tell() < best[0].tell():
+                    best = (buffer, lossless, encoder, quality, save_kwargs)
+            buffer, lossless, encoder, quality, save_kwargs = best
+            variants = self._encode_variants(img, save_kwargs, encoder)
+
+        if extension and not target_size and buffer.tell() >= original_size:
+            # 重新编码没有变小，保留原图
+            data, info = self._passthrough(source, width, height, extension, started_at)
+            info["decode_seconds"] = decode_seconds
+            info["budget_limited"] = budget_limited
+            if variants:
+                info["variants"] = variants
+            return data, info
+        info = {
+            "width": img.width,
+            "height": img.height,
+            "original_width": width,
+            "original_height": height,
+            "quality": quality,
+            "method": save_kwargs.get("method", method),
+            "encode_seconds": time.perf_counter() - started_at,
+            "decode_seconds": decode_seconds,
+            "passthrough": False,
+            "extension": ENCODERS[encoder].extension,
+            "encoder": encoder,
+            "mode": "lossless" if lossless else "lossy",
+            "budget_limited": budget_limited,
+        }
+        if variants:
+            info["variants"] = variants
+        return buffer.getvalue(), info
+
+    def _encode_variants(
+        self, img: Image.Image, save_kwargs: dict, encoder: str
+    ) -> List[dict]:
+        """
+        按 srcset_widths 从大到小生成响应式档位
 
-                # 根据质量设置选择不同的压缩策略
-                save_kwargs = {
-                    "format": "WEBP",
-                    "quality": self.quality,
-                    "optimize": True,
-                    "method": 6,  # 使用最佳压缩方法
+        每一档都从上一档缩小得到，不重新解码，缩放的像素量逐级减少；
+        不小于主图宽度的档位跳过（主图本身即最大一档）
+        """
+        variants = []
+        for width in self.srcset_widths:
+            if width >= img.width:
+                continue
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+            buffer, lossless = self._encode_still(img, save_kwargs, encoder)
+            variants.append(
+                {
+                    "width": width,
+                    "height": height,
+                    "extension": ENCODERS[encoder].extension,
+                    "mode": "lossless" if lossless else "lossy",
+                    "data": buffer.getvalue(),
                 }
+            )
+        return variants
+
+    def _encode_still(
+        self, img: Image.Image, save_kwargs: dict, encoder: str = "webp"
+    ) -> Tuple[io.BytesIO, bool]:
+        """
+        编码静态图片，返回 (编码结果, 是否无损)
+
+        需要比较时无损编码放在线程中与有损编码同时进行（Pillow 编码期间释放 GIL），
+        保留较小的一份；编码器不支持无损时只做有损编码。
+        设置 target_bytes 时超出体积预算的无损结果不会胜出，
+        lossless=True 时也改用（按预算搜索过质量的）有损结果
+        """
+        lossless_kwargs = ENCODERS[encoder].lossless_kwargs(
+            save_kwargs.get("method", 6), self.LOSSLESS_EFFORT
+        )
+        if lossless_kwargs and self.lossless is True:
+            lossless_buffer = self._save_lossless(img, lossless_kwargs)
+            if not self.target_bytes or lossless_buffer.tell() <= self.target_bytes:
+                return lossless_buffer, True
+            buffer = io.BytesIO()
+            img.save(buffer, **save_kwargs)
+            if lossless_buffer.tell() < buffer.tell():
+                # 有损编码同样超出预算时取较小的一份
+                return lossless_buffer, True
+            return buffer, False
+        if not (
+            lossless_kwargs
+            and self.lossless == "auto"
+            and self.is_lossless_candidate(img)
+        ):
+            buffer = io.BytesIO()
+            img.save(buffer, **save_kwargs)
+            return buffer, False
+
+        # Image.save 会把参数写到图片对象上，两个线程不能同时保存同一个对象
+        lossless_img = img.copy()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._save_lossless, lossless_img, lossless_kwargs)
+            buffer = io.BytesIO()
+            img.save(buffer, **save_kwargs)
+            lossless_buffer = future.result()
+        if lossless_buffer.tell() < buffer.tell():
+            return lossless_buffer, True
+        return buffer, False
+
+    @staticmethod
+    def _save_lossless(img: Image.Image, lossless_kwargs: dict) -> io.BytesIO:
+        buffer = io.BytesIO()
+        img.save(buffer, **lossless_kwargs)
+        return buffer
+
+    def is_lossless_candidate(self, img: Image.Image) -> bool:
+        """按缩略图的颜色数粗略判断是否为截图、图表等适合无损编码的图片"""
+        scale = self.LOSSLESS_SAMPLE_SIZE / max(img.size)
+        sample = img
+        if scale < 1:
+            # 最近邻采样不引入新的过渡色，且只读取采样到的像素
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            sample = img.resize(size, Image.NEAREST)
+        return sample.getcolors(self.LOSSLESS_MAX_COLORS) is not None
+
+    def _encode_animation(
+        self,
+        img: Image.Image,
+        target_size: Optional[Tuple[int, int]],
+        time_budget: Optional[float],
+    ) -> Tuple[bytes, dict]:
+        """
+        动图（GIF / APNG / 动态 WebP）编码为动态 WebP
+
+        Pillow 的 save_all 逐帧读取并交给编码器，内存中只保留当前帧与已编码数据；
+        先按 max_fps 合并过密的帧，再按 max_frames 均匀抽帧，被丢弃帧的时长并入前一帧。
+        """
+        frames, durations = self.select_frames(img)
+        width, height = target_size or img.size
+        pixels = width * height * len(frames)
+        method = self.choose_method(pixels, time_budget)
+        save_kwargs = self._save_kwargs(self.quality, method, "webp")
+        sequence = _FrameSequence(img, frames, target_size)
+        sequence.seek(0)
+        first = sequence.frame.copy()
+        buffer = io.BytesIO()
+        first.save(
+            buffer,
+            save_all=True,
+            append_images=[_FrameSequence(img, frames[1:], target_size)],
+            duration=durations,
+            loop=img.info.get("loop", 0),
+            background=(0, 0, 0, 0),
+            **save_kwargs,
+        )
+        info = {
+            "width": width,
+            "height": height,
+            "original_width": img.width,
+            "original_height": img.height,
+            "quality": self.quality,
+            "method": save_kwargs["method"],
+            "frames": len(frames),
+            "source_frames": img.n_frames,
+            "passthrough": False,
+            "extension": ".webp",
+            "budget_limited": method < self.choose_method(pixels),
+        }
+        return buffer.getvalue(), info
+
+    def select_frames(self, img: Image.Image) -> Tuple[List[int], List[int]]:
+        """按 max_fps / max_frames 选出要保留的帧，返回 (帧序号, 每帧时长ms)"""
+        durations = []
+        for index in range(img.n_frames):
+            img.seek(index)
+            # GIF 中 0 时长按浏览器的惯例视为 100ms
+            durations.append(img.info.get("duration") or 100)
+        img.seek(0)
+
+        frames: List[int] = []
+        kept: List[int] = []
+        min_interval = 1000 / self.max_fps if self.max_fps else 0
+        for index, duration in enumerate(durations):
+            if kept and kept[-1] < min_interval:
+                kept[-1] += duration
+            else:
+                frames.append(index)
+                kept.append(duration)
+
+        if self.max_frames and len(frames) > self.max_frames:
+            step = math.ceil(len(frames) / self.max_frames)
+            frames = frames[::step]
+            kept = [sum(kept[i : i + step]) for i in range(0, len(kept), step)]
+        return frames, kept
+
+    def _is_already_optimal(
+        self,
+        img: Image.Image,
+        original_size: int,
+        target_size: Optional[Tuple[int, int]] = None,
+    ) -> bool:
+        """仅凭文件头判断重新编码是否没有收益：动图 WebP，或每像素比特数已很低的 WebP"""
+        if img.format != "WEBP":
+            return False
+        if getattr(img, "is_animated", False):
+            # 动态 WebP 重新编码收益很小，除非需要抽帧
+            return not (self.max_frames or self.max_fps)
+        if target_size:
+            return False
+        if self.target_bytes and original_size > self.target_bytes:
+            return False
+        bits_per_pixel = original_size * 8 / max(1, img.width * img.height)
+        return bits_per_pixel <= self.PASSTHROUGH_WEBP_BPP
+
+    @staticmethod
+    def _passthrough(
+        source: Union[str, bytes],
+        width: int,
+        height: int,
+        extension: str,
+        started_at: float,
+    ) -> Tuple[bytes, dict]:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        info = {
+            "width": width,
+            "height": height,
+            "original_width": width,
+            "original_height": height,
+            "quality": None,
+            "method": None,
+            "encode_seconds": time.perf_counter() - started_at,
+            "passthrough": True,
+            "extension": extension,
+        }
+        return data, info
+
+    def choose_method(self, pixels: int, time_budget: Optional[float] = None) -> int:
+        """
+        选择编码器 method (0~6，越大越慢、体积越小)
+
+        effort 为 "max" 时固定 6；为整数时固定该值；
+        为 "auto" 时先按像素数封顶，再选预计耗时不超过 time_budget 的最大 method。
+        """
+        if self.effort == "max":
+            return 6
+        if self.effort != "auto":
+            return self.effort
+
+        method = 2
+        for max_pixels, capped_method in self.EFFORT_PIXEL_STEPS:
+            if pixels <= max_pixels:
+                method = capped_method
+                break
+        if time_budget is not None:
+            megapixels = pixels / 1_000_000
+            while method > 0 and self.METHOD_COST[method] * megapixels > time_budget:
+                method -= 1
+        return method
+
+    def _save_kwargs(
+        self, quality: int, method: int = 6, encoder: Optional[str] = None
+    ) -> dict:
+        """按质量与 method 生成保存参数，encoder 默认为首个编码器"""
+        return ENCODERS[encoder or self.encoders[0]].save_kwargs(
+            quality, method, self.alpha_quality
+        )
 
-                # 低质量时使用更激进的压缩
-                if self.quality < 50:
-                    save_kwargs["lossless"] = False
-                    save_kwargs["method"] = 6
-                elif self.quality > 90:
-                    # 高质量时保持更多细节
-                    save_kwargs["method"] = 4
+    @property
+    def has_target(self) -> bool:
+        """是否启用按目标搜索质量的模式"""
+        return bool(self.target_bytes or self.min_ssim or self.min_psnr)
+
+    def _target_key(self) -> Tuple:
+        return (
+            self.target_bytes,
+            self.min_ssim,
+            self.min_psnr,
+            self.max_width,
+            self.max_height,
+        )
+
+    def estimate_memory(self, source: Union[str, bytes]) -> int:
+        """
+        只读文件头估算解码与编码的峰值内存(bytes)
+
+        JPEG 需要缩小时按 draft 的缩小倍数计算实际解码的像素数；
+        估算包含解码图、转为 RGB 的副本与编码器的工作缓冲。
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with Image.open(source) as img:
+            width, height = img.size
+            bands = len(img.getbands())
+            target_size = self.target_size(width, height)
+            if target_size and img.format == "JPEG":
+                scale = 1
+                while (
+                    scale < 8
+                    and width // (scale * 2) >= target_size[0]
+                    and height // (scale * 2) >= target_size[1]
+                ):
+                    scale *= 2
+                width, height = width // scale, height // scale
+        return width * height * (bands + 3 + 4)
+
+    def target_size(self, width: int, height: int) -> Optional[Tuple[int, int]]:
+        """按 max_width / max_height 等比缩小后的尺寸，无需缩小时返回 None"""
+        scale = 1.0
+        if self.max_width:
+            scale = min(scale, self.max_width / width)
+        if self.max_height:
+            scale = min(scale, self.max_height / height)
+        if scale >= 1.0:
+            return None
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    @staticmethod
+    def _content_digest(source: Union[str, bytes]) -> str:
+        digest = hashlib.sha1()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            digest.update(source)
+        else:
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def choose_quality(
+        self,
+        img: Image.Image,
+        digest: Optional[str] = None,
+        method: int = 6,
+        encoder: Optional[str] = None,
+    ) -> int:
+        """
+        为单张图片搜索满足目标的最低质量
+
+        在缩小的探测图上二分搜索（最多约 7 次编码），结果按 (内容哈希, 目标) 缓存。
+        同时设置了体积与画质目标时，体积预算优先。
+        """
+        encoder = encoder or self.encoders[0]
+        key = (digest, self._target_key(), encoder) if digest else None
+        if key is not None:
+            with _QUALITY_CACHE_LOCK:
+                if key in _QUALITY_CACHE:
+                    _QUALITY_CACHE.move_to_end(key)
+                    return _QUALITY_CACHE[key]
 
-                # 保存为WebP格式
-                img.save(output_path, **save_kwargs)
+        quality = self._search_quality(img, method, encoder)
 
-                # 获取转换后文件大小
-                converted_size = os.path.getsize(output_path)
+        if key is not None:
+            with _QUALITY_CACHE_LOCK:
+                _QUALITY_CACHE[key] = quality
+                while len(_QUALITY_CACHE) > _QUALITY_CACHE_SIZE:
+                    _QUALITY_CACHE.popitem(last=False)
+        return quality
 
-                return True, original_size, converted_size
+    def _search_quality(
+        self, img: Image.Image, method: int = 6, encoder: Optional[str] = None
+    ) -> int:
+        probe = img.copy()
+        probe.thumbnail((self.PROBE_SIZE, self.PROBE_SIZE), Image.LANCZOS)
+        # 探测图体积按像素比例放大，用来估算原图编码后的体积
+        scale = (img.width * img.height) / max(1, probe.width * probe.height)
+        encoded: Dict[int, bytes] = {}
+
+        def encode_probe(quality: int) -> bytes:
+            if quality not in encoded:
+                buffer = io.BytesIO()
+                probe.save(buffer, **self._save_kwargs(quality, method, encoder))
+                encoded[quality] = buffer.getvalue()
+            return encoded[quality]
+
+        def meets_floor(quality: int) -> bool:
+            with Image.open(io.BytesIO(encode_probe(quality))) as decoded:
+                decoded = decoded.convert(probe.mode)
+                if self.min_psnr and _psnr(probe, decoded) < self.min_psnr:
+                    return False
+                if self.min_ssim and np is not None:
+                    return _ssim(probe, decoded) >= self.min_ssim
+                return True
+
+        def over_budget(quality: int) -> bool:
+            return len(encode_probe(quality)) * scale > self.target_bytes
+
+        lo, hi = self.QUALITY_SEARCH_RANGE
+        quality = hi
+        if self.min_ssim or self.min_psnr:
+            quality = min(hi, _first_quality(lo, hi, meets_floor))
+        if self.target_bytes:
+            quality = min(quality, max(lo, _first_quality(lo, hi, over_budget) - 1))
+        return quality
+
+    def convert_to_webp(
+        self, input_path: str, output_path: str
+    ) -> Tuple[bool, int, int]:
+        """
+        将图片转换为WebP格式
+
+        Returns:
+            Tuple[成功状态, 原始文件大小(bytes), 转换后文件大小(bytes)]
+        """
+        try:
+            # 获取原始文件大小
+            original_size = os.path.getsize(input_path)
+            data = self.encode_webp(input_path)
+            with open(output_path, "wb") as f:
+                f.write(data)
+            return True, original_size, len(data)
 
         except Exception as e:
             print(f"WebP转换失败: {e}")
             return False, 0, 0
 
+    @staticmethod
+    def new_image_name() -> str:
+        """生成输出图片文件名（不含扩展名）"""
+        timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+        return f"img_{timestamp}_{random.randint(1000, 9999)}"
+
     def download_and_convert(
         self, url: str, output_dir: str
     ) -> Optional[Tuple[str, int, int]]:
         """
         下载网络图片并转换为WebP
 
+        小图在内存中完成解码与编码，只写一次输出文件；
+        超过 spill_threshold 的图片才会经过临时文件。
+        已充分压缩或重新编码反而变大的图片保留原格式与原始字节。
+
         Returns:
             Optional[Tuple[输出路径, 原始大小, 转换后大小]]
         """
+        source = self.download(url)
+        if source is None:
+            return None
+
+        try:
+            original_size = source_size(source)
+            with DECODE_MEMORY_BUDGET.reserve(self.estimate_memory(source)):
+                data, info = self.encode_webp_detailed(source, passthrough=True)
+            output_path = os.path.join(
+                output_dir, f"{self.new_image_name()}{info['extension']}"
+            )
+            with open(output_path, "wb") as f:
+                f.write(data)
+            return output_path, original_size, len(data)
+        except Exception as e:
+            print(f"WebP转换失败: {e}")
+            return None
+        finally:
+            release_source(source)
+
+    def download(self, url: str) -> Optional[Union[bytes, str]]:
+        """
+        下载网络图片
+
+        Returns:
+            图片字节；超过 spill_threshold 时为临时文件路径（可用 release_source 删除）；
+            失败时为 None
+        """
+        return self.download_detailed(url)[0]
+
+    def download_detailed(self, url: str) -> Tuple[Optional[Union[bytes, str]], dict]:
+        """
+        同 download，额外返回下载信息：bytes_fetched（实际传输的字节数）、
+        http_cache（"miss" 未缓存、"stored" 已写入缓存、"revalidated" 服务端返回 304）
+
+        启用 use_cache 时，带 ETag / Last-Modified 的响应体写入 HTTP 缓存；再次下载时
+        发送 If-None-Match / If-Modified-Since，304 时直接返回缓存内容，随后的编码按内容
+        哈希命中编码结果缓存，整张图片既不重新传输也不重新编码。
+
+        连接中断时按 Range 从已收到的位置续传（最多 DOWNLOAD_RETRIES 次）；
+        download_segments > 1 时大图拆成多段并行下载
+
+        请求经主机调度器限制每个主机与全局的并发数；服务端返回 429 / 503 时该主机
+        整体退避（遵循 Retry-After），随后重试，最多 DOWNLOAD_RETRIES 次
+        """
+        info = {"bytes_fetched": 0, "http_cache": "miss"}
+        sink = None
         try:
             # 为部分站点添加常见请求头，避免被简单的反爬/热链保护拦截
             headers = {
@@ -113,7 +1203,6 @@ class WebPConverter:
             }
 
             # 处理包含空格与中文字符的 URL（例如阿里云 OSS 对象名中存在空格）
-            # 先快速 HEAD 取 Content-Type
             safe_url = requests.utils.requote_uri(url)
             # 动态设置 Referer：多数站点允许来自自身域的请求
             try:
@@ -125,78 +1214,1099 @@ class WebPConverter:
             except Exception:
                 # 回退到通用 Referer
                 headers.setdefault("Referer", "https://www.google.com/")
+
+            cache = get_http_cache() if self.use_cache else None
+            cached = self._cached_response(cache, safe_url)
+            if cached is not None:
+                validators = cached[0]
+                if validators.get("etag"):
+                    headers["If-None-Match"] = validators["etag"]
+                if validators.get("last_modified"):
+                    headers["If-Modified-Since"] = validators["last_modified"]
+
+            scheduler = get_host_scheduler() if get_host_scheduler else None
+            for attempt in range(self.DOWNLOAD_RETRIES + 1):
+                # 下载（含续传）占用该主机的一个并发名额，分段请求另外申请名额
+                with scheduler.slot(safe_url) if scheduler else nullcontext():
+                    # 直接发起 GET（流式），内容类型从响应头校验，无需额外的 HEAD 往返
+                    # 超时：连接 8s，读取 25s
+                    resp = requests.get(
+                        safe_url,
+                        headers=headers,
+                        timeout=(8, 25),
+                        stream=True,
+                        allow_redirects=True,
+                    )
+                    if scheduler:
+                        scheduler.report(
+                            safe_url, resp.status_code, resp.headers.get("Retry-After")
+                        )
+                    if (
+                        resp.status_code in THROTTLE_STATUS_CODES
+                        and attempt < self.DOWNLOAD_RETRIES
+                    ):
+                        # 释放名额后等待该主机退避结束再重试
+                        resp.close()
+                        if not scheduler:
+                            time.sleep(self.RETRY_BACKOFF * (attempt + 1))
+                        continue
+                    sink = _DownloadSink(self.spill_threshold, self.PROBE_BYTES)
+                    return self._receive(
+                        resp, safe_url, headers, cache, cached, sink, info
+                    )
+
+        except Exception as e:
+            print(f"下载和转换失败: {e}")
+            if sink is not None:
+                sink.discard()
+            return None, info
+
+    def _receive(
+        self,
+        resp: requests.Response,
+        url: str,
+        headers: dict,
+        cache,
+        cached: Optional[tuple],
+        sink: "_DownloadSink",
+        info: dict,
+    ) -> Tuple[Optional[Union[bytes, str]], dict]:
+        """校验响应并读取响应体，返回 (图片内容, 下载信息)"""
+        if resp.status_code == 304 and cached is not None:
+            resp.close()
+            info["http_cache"] = "revalidated"
+            return cached[1], info
+        resp.raise_for_status()
+
+        # 简单校验内容类型
+        ctype = resp.headers.get("Content-Type", "")
+        if "image" not in ctype.lower():
+            raise ValueError(f"非图片资源，Content-Type={ctype}")
+        # 声明的长度已超过上限时不读取响应体
+        content_length = resp.headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > self.MAX_DOWNLOAD_BYTES:
+            raise ValueError(f"图片超过 15MB（{content_length} bytes），未下载")
+
+        validator = _range_validator(resp)
+        # 每个额外的分段请求都占用该主机的一个并发名额，名额不足时少分段或不分段
+        wanted = max(0, len(self._plan_segments(resp, validator)) - 1)
+        scheduler = get_host_scheduler() if get_host_scheduler else None
+        extra_slots = (
+            scheduler.extra_slots(url, wanted) if scheduler else nullcontext(wanted)
+        )
+        with extra_slots as extra:
+            segments = self._plan_segments(resp, validator, 1 + extra) if extra else []
+            with ThreadPoolExecutor(max_workers=max(1, extra)) as executor:
+                # 第一段继续读取当前响应，其余各段同时用 Range 请求下载
+                futures = [
+                    executor.submit(
+                        self._fetch_range, url, headers, validator, start, end
+                    )
+                    for start, end in segments[1:]
+                ]
+                first_end = segments[0][1] if segments else None
+                self._read_resumable(
+                    resp, url, headers, validator, sink, info, first_end
+                )
+                for future in futures:
+                    self._write_chunk(sink, future.result(), info)
+        if sink.probe_at and sink.buffer is not None:
+            # 图片比探测长度还小，完整内容下载后再检查一次
+            info["probe"] = self._check_header(sink.buffer.getvalue(), final=True)
+
+        source = sink.result()
+        if (
+            isinstance(source, bytes)
+            and cache is not None
+            and self._store_response(cache, url, resp, source)
+        ):
+            info["http_cache"] = "stored"
+        return source, info
+
+    def _write_chunk(self, sink: "_DownloadSink", chunk: bytes, info: dict):
+        """写入一段下载内容，超过大小上限时抛出 ValueError，并在够长时探测文件头"""
+        if not chunk:
+            return
+        info["bytes_fetched"] += len(chunk)
+        if sink.size + len(chunk) > self.MAX_DOWNLOAD_BYTES:
+            raise ValueError("图片超过 15MB，已取消")
+        sink.write(chunk)
+        if sink.probe_at and sink.buffer is not None and sink.size >= sink.probe_at:
+            # 只凭开头几 KB 判断，不支持或超限的图片不再继续传输
+            info["probe"] = self._check_header(sink.buffer.getvalue(), final=False)
+            sink.probe_at = 0 if info["probe"] else sink.size * 2
+            if sink.size >= self.PROBE_MAX_BYTES:
+                sink.probe_at = 0
+
+    def _read_resumable(
+        self,
+        resp: requests.Response,
+        url: str,
+        headers: dict,
+        validator: Optional[str],
+        sink: "_DownloadSink",
+        info: dict,
+        end: Optional[int] = None,
+    ):
+        """
+        读取响应体直到结束（或第 end 字节），连接中断时从已收到的位置续传
+
+        续传请求带 Range 与 If-Range，服务端内容未变时返回 206 继续追加；
+        不支持 Range、内容已变化或没有校验信息时返回完整内容，丢弃已收到的部分重新下载
+        """
+        attempt = 0
+        while True:
             try:
-                head = requests.head(
-                    safe_url,
-                    headers=headers,
-                    timeout=(5, 10),
+                if resp is None:
+                    resp = self._resume_request(url, headers, validator, sink, end)
+                for chunk in resp.iter_content(chunk_size=16 * 1024):
+                    if end is not None:
+                        chunk = chunk[: end + 1 - sink.size]
+                    self._write_chunk(sink, chunk, info)
+                    if end is not None and sink.size > end:
+                        break
+                if end is not None and sink.size <= end:
+                    raise requests.exceptions.ChunkedEncodingError("连接提前关闭")
+                resp.close()
+                return
+            except _RESUMABLE_ERRORS as e:
+                if resp is not None:
+                    resp.close()
+                resp = None
+                attempt += 1
+                if attempt > self.DOWNLOAD_RETRIES:
+                    raise
+                print(f"下载中断，第 {attempt} 次从 {sink.size} 字节处续传: {e}")
+                time.sleep(self.RETRY_BACKOFF * attempt)
+
+    def _resume_request(
+        self,
+        url: str,
+        headers: dict,
+        validator: Optional[str],
+        sink: "_DownloadSink",
+        end: Optional[int],
+    ) -> requests.Response:
+        resp = requests.get(
+            url,
+            headers=_range_headers(headers, validator, sink.size, end),
+            timeout=(8, 25),
+            stream=True,
+            allow_redirects=True,
+        )
+        content_range = resp.headers.get("Content-Range", "")
+        if resp.status_code == 206 and content_range.startswith(f"bytes {sink.size}-"):
+            return resp
+        resp.raise_for_status()
+        if end is not None:
+            # 分段下载中途内容变化，各段无法拼接
+            resp.close()
+            raise ValueError("图片在分段下载期间发生变化，已取消")
+        sink.reset()
+        return resp
+
+    def _plan_segments(
+        self,
+        resp: requests.Response,
+        validator: Optional[str],
+        max_segments: Optional[int] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        按 download_segments（且不超过 max_segments）把响应体划分为 [start, end] 字节区间，
+        不适合分段时返回空列表
+        """
+        length = resp.headers.get("Content-Length", "")
+        if (
+            self.download_segments <= 1
+            or validator is None
+            or resp.headers.get("Accept-Ranges", "").lower() != "bytes"
+            or resp.headers.get("Content-Encoding")
+            or not length.isdigit()
+        ):
+            return []
+        length = int(length)
+        segments = min(self.download_segments, length // self.SEGMENT_MIN_BYTES)
+        if max_segments is not None:
+            segments = min(segments, max_segments)
+        if segments <= 1:
+            return []
+        size = math.ceil(length / segments)
+        return [
+            (start, min(start + size, length) - 1) for start in range(0, length, size)
+        ]
+
+    def _fetch_range(
+        self, url: str, headers: dict, validator: str, start: int, end: int
+    ) -> bytes:
+        """下载 [start, end] 字节区间，中断时从区间内已收到的位置续传"""
+        data = bytearray()
+        for attempt in range(self.DOWNLOAD_RETRIES + 1):
+            try:
+                with requests.get(
+                    url,
+                    headers=_range_headers(headers, validator, start + len(data), end),
+                    timeout=(8, 25),
+                    stream=True,
                     allow_redirects=True,
-                )
-                head.raise_for_status()
-            except Exception:
-                # 忽略 head 失败，继续走 get
-                pass
-
-            # 先发起 GET（流式）并设置合理超时：连接 8s，读取 25s
-            resp = requests.get(
-                safe_url,
-                headers=headers,
-                timeout=(8, 25),
-                stream=True,
-                allow_redirects=True,
+                ) as resp:
+                    content_range = resp.headers.get("Content-Range", "")
+                    if resp.status_code != 206 or not content_range.startswith(
+                        f"bytes {start + len(data)}-"
+                    ):
+                        raise ValueError(f"分段下载失败，状态码 {resp.status_code}")
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        data.extend(chunk)
+                if len(data) > end - start:
+                    return bytes(data[: end - start + 1])
+                raise requests.exceptions.ChunkedEncodingError("连接提前关闭")
+            except _RESUMABLE_ERRORS:
+                if attempt == self.DOWNLOAD_RETRIES:
+                    raise
+                time.sleep(self.RETRY_BACKOFF * (attempt + 1))
+        raise ValueError("分段下载失败")
+
+    def _check_header(self, data: bytes, final: bool) -> Optional[dict]:
+        """
+        按文件头检查下载中的图片，不支持的格式或像素数超过解压炸弹上限时抛出 ValueError
+
+        Args:
+            final: data 是否已是完整内容；为 False 时无法识别可能只是数据还不够
+
+        Returns:
+            probe_header 的结果，暂时无法解析时为 None
+        """
+        try:
+            header = probe_header(data)
+        except Image.DecompressionBombError:
+            raise ValueError("图片像素数超过解压炸弹上限，已取消下载")
+        if header is None:
+            if final or not _has_known_signature(data):
+                raise ValueError("无法识别的图片格式，已取消下载")
+            return None
+        pixels = header["width"] * header["height"]
+        if Image.MAX_IMAGE_PIXELS and pixels > 2 * Image.MAX_IMAGE_PIXELS:
+            raise ValueError(
+                f"图片尺寸 {header['width']}x{header['height']} 超过上限，已取消下载"
             )
-            resp.raise_for_status()
+        return header
 
-            # 简单校验内容类型
-            ctype = resp.headers.get("Content-Type", "")
-            if "image" not in ctype.lower():
-                raise ValueError(f"非图片资源，Content-Type={ctype}")
+    @staticmethod
+    def _cached_response(cache, url: str) -> Optional[Tuple[dict, bytes]]:
+        """读取 HTTP 缓存中的 (校验信息, 响应体)，不存在时返回 None"""
+        if cache is None:
+            return None
+        try:
+            validators = cache.get(f"http:{url}:meta")
+            data = cache.get(f"http:{url}") if validators else None
+        except Exception as e:
+            print(f"读取 HTTP 缓存失败: {e}")
+            return None
+        if data is None:
+            return None
+        return validators, data
 
-            # 限制最大下载大小（例如 15MB），防止超大图阻塞
-            max_bytes = 15 * 1024 * 1024
-            downloaded = 0
+    @staticmethod
+    def _store_response(cache, url: str, resp, data: bytes) -> bool:
+        """响应带 ETag 或 Last-Modified 时写入 HTTP 缓存（落盘的大图不缓存）"""
+        validators = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        }
+        cache_control = resp.headers.get("Cache-Control", "").lower()
+        if not any(validators.values()) or "no-store" in cache_control:
+            return False
+        try:
+            cache.set_many({f"http:{url}": data, f"http:{url}:meta": validators})
+        except Exception as e:
+            print(f"写入 HTTP 缓存失败: {e}")
+            return False
+        return True
 
-            # 生成临时文件名
-            timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
-            temp_name = f"img_{timestamp}_{random.randint(1000, 9999)}"
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as temp_file:
-                for chunk in resp.iter_content(chunk_size=64 * 1024):
-                    if not chunk:
-                        continue
-                    downloaded += len(chunk)
-                    if downloaded > max_bytes:
-                        raise ValueError("图片超过 15MB，已取消")
-                    temp_file.write(chunk)
-                temp_path = temp_file.name
-
-            # 转换为 WebP
-            output_path = os.path.join(output_dir, f"{temp_name}.webp")
-            success, original_size, converted_size = self.convert_to_webp(
-                temp_path, output_path
+def output_extensions() -> Tuple[str, ...]:
+    """转换可能写出的全部扩展名：各编码器的输出格式与原样保留的格式"""
+    extensions = [encoder.extension for encoder in ENCODERS.values()]
+    extensions += WebPConverter.PASSTHROUGH_FORMATS.values()
+    return tuple(dict.fromkeys(extensions))
+
+
+def _has_known_signature(data: bytes) -> bool:
+    """开头的字节是否符合 Pillow 已注册的任一图片格式签名"""
+    Image.init()
+    prefix = bytes(data[:16])
+    for _, accept in Image.OPEN.values():
+        try:
+            if accept and accept(prefix):
+                return True
+        except Exception:
+            continue
+    return False
+
+
+def _webp_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """从 RIFF 头解析 WebP 宽高（Pillow 需要完整文件才能打开 WebP）"""
+    if len(data) < 30 or data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        return None
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width = int.from_bytes(data[26:28], "little") & 0x3FFF
+        height = int.from_bytes(data[28:30], "little") & 0x3FFF
+        return width, height
+    if chunk == b"VP8L":
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def probe_header(data: bytes) -> Optional[dict]:
+    """
+    只用图片开头的字节解析格式与宽高，返回 {format, width, height}
+
+    数据不足以解析（例如 JPEG 的 EXIF 很大）或格式无法识别时返回 None；
+    像素数超过 2 倍 Image.MAX_IMAGE_PIXELS 时 Pillow 抛出 DecompressionBombError
+    """
+    size = _webp_size(data)
+    if size is not None:
+        return {"format": "WEBP", "width": size[0], "height": size[1]}
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return {"format": img.format, "width": img.width, "height": img.height}
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        return None
+
+
+def perceptual_hash(source: Union[str, bytes], hash_size: int = 8) -> int:
+    """
+    计算图片的感知哈希 (dHash)
+
+    缩成 (hash_size+1) x hash_size 的灰度缩略图，逐行比较相邻像素的明暗得到
+    hash_size^2 位指纹。重新保存、轻微裁剪或缩放后指纹的汉明距离仍然很小。
+    JPEG 通过 draft 缩小解码，有 numpy 时比较过程向量化。
+    """
+    return image_fingerprint(source, hash_size)["phash"]
+
+
+def image_fingerprint(source: Union[str, bytes], hash_size: int = 8) -> dict:
+    """
+    近似重复判定用的图片指纹：phash、width、height、frames、mean
+
+    dHash 只反映明暗走向，纯色图与许多平坦图片的指纹相同，因此另外记录
+    原始尺寸、帧数与缩略图的平均颜色，供 PerceptualHashIndex 一并比较。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        width, height = img.size
+        frames = getattr(img, "n_frames", 1)
+        img.draft("RGB", (hash_size * 8, hash_size * 8))
+        thumb = img.convert("RGB").resize((hash_size + 1, hash_size), Image.BOX)
+    return {
+        "phash": _dhash(thumb.convert("L"), hash_size),
+        "width": width,
+        "height": height,
+        "frames": frames,
+        "mean": tuple(ImageStat.Stat(thumb).mean),
+    }
+
+
+def _dhash(thumb: Image.Image, hash_size: int) -> int:
+    if np is not None:
+        pixels = np.asarray(thumb, dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    pixels = list(thumb.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col + 1] > pixels[offset + col])
+    return value
+
+
+class PerceptualHashIndex:
+    """
+    感知哈希索引：查找与已登记图片近似重复的图片
+
+    除汉明距离不超过阈值外，还要求帧数相同、宽高比与平均颜色相近；
+    全 0 或全 1 的低信息量指纹（纯色、单向渐变）既不登记也不参与匹配。
+    """
+
+    # 宽高比的相对误差与平均颜色单通道差值的上限
+    ASPECT_TOLERANCE = 0.05
+    MEAN_TOLERANCE = 12
+
+    def __init__(self, threshold: int = 5, hash_size: int = 8):
+        self.threshold = threshold
+        self._full_hash = (1 << hash_size * hash_size) - 1
+        self._hashes: List[int] = []
+        self._fingerprints: List[dict] = []
+        self._items: list = []
+        self._lock = threading.Lock()
+
+    def find_or_add(self, fingerprint: dict, item):
+        """返回已登记的近似重复项；没有时登记 item 并返回 None"""
+        phash = fingerprint["phash"]
+        if phash in (0, self._full_hash):
+            return None
+        with self._lock:
+            for index in self._candidates(phash):
+                if self._similar(self._fingerprints[index], fingerprint):
+                    return self._items[index]
+            self._hashes.append(phash)
+            self._fingerprints.append(fingerprint)
+            self._items.append(item)
+            return None
+
+    def replace(self, item, new_item, fingerprint: dict):
+        """用 new_item 及其指纹取代已登记的 item"""
+        with self._lock:
+            index = next(i for i, x in enumerate(self._items) if x is item)
+            self._hashes[index] = fingerprint["phash"]
+            self._fingerprints[index] = fingerprint
+            self._items[index] = new_item
+
+    def _candidates(self, phash: int) -> List[int]:
+        """汉明距离不超过阈值的已登记项，按距离从近到远"""
+        if not self._hashes:
+            return []
+        if np is not None:
+            xor = np.bitwise_xor(
+                np.asarray(self._hashes, dtype=np.uint64), np.uint64(phash)
             )
+            distances = np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+        else:
+            distances = [bin(h ^ phash).count("1") for h in self._hashes]
+        close = [i for i in range(len(self._hashes)) if distances[i] <= self.threshold]
+        return sorted(close, key=distances.__getitem__)
+
+    def _similar(self, a: dict, b: dict) -> bool:
+        if a["frames"] != b["frames"]:
+            return False
+        aspect_a = a["width"] / a["height"]
+        aspect_b = b["width"] / b["height"]
+        if abs(aspect_a - aspect_b) > self.ASPECT_TOLERANCE * max(aspect_a, aspect_b):
+            return False
+        return all(
+            abs(x - y) <= self.MEAN_TOLERANCE for x, y in zip(a["mean"], b["mean"])
+        )
+
+
+class _FrameSequence:
+    """
+    动图部分帧的惰性序列，供 Pillow save_all 的 append_images 使用
+
+    save_all 通过 n_frames / seek 逐帧读取，seek 时才解码并转换该帧，
+    其余属性委托给当前帧，因此任一时刻只有一帧在内存中。
+    """
+
+    def __init__(
+        self,
+        image: Image.Image,
+        frames: List[int],
+        target_size: Optional[Tuple[int, int]] = None,
+    ):
+        self._image = image
+        self._frames = frames
+        self._target_size = target_size
+        self.n_frames = len(frames)
+        self.frame: Optional[Image.Image] = None
+
+    def seek(self, index: int):
+        self._image.seek(self._frames[index])
+        frame = self._image.convert("RGBA")
+        if self._target_size and frame.size != self._target_size:
+            frame = frame.resize(self._target_size, Image.LANCZOS)
+        self.frame = frame
 
-            # 清理临时文件
+    def tell(self) -> int:
+        return 0
+
+    def __getattr__(self, name: str):
+        return getattr(self.frame, name)
+
+
+STAGE_TIMING_KEYS = ("fetch_ms", "decode_ms", "encode_ms", "write_ms", "upload_ms")
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """最近秩百分位数，sorted_values 需已升序排列"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def stage_percentiles(images: List[dict]) -> Dict[str, Dict[str, float]]:
+    """按阶段汇总每张图片记录中的耗时，返回 {阶段: {p50, p90, p99, max}}"""
+    result = {}
+    for key in STAGE_TIMING_KEYS:
+        values = sorted(image.get(key, 0) for image in images)
+        result[key] = {
+            "p50": _percentile(values, 0.5),
+            "p90": _percentile(values, 0.9),
+            "p99": _percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+        }
+    return result
+
+
+def source_size(source: Union[bytes, str]) -> int:
+    """图片源的字节数：内存数据取长度，文件取文件大小"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    return os.path.getsize(source)
+
+
+# 可以续传的网络错误：连接中断、读取超时、响应体不完整
+_RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def _range_validator(resp: requests.Response) -> Optional[str]:
+    """If-Range 可用的校验值：强 ETag 或 Last-Modified，没有时无法安全续传"""
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return resp.headers.get("Last-Modified")
+
+
+def _range_headers(
+    headers: dict, validator: Optional[str], start: int, end: Optional[int]
+) -> dict:
+    """续传请求头；没有校验值时不带 Range，服务端返回完整内容"""
+    headers = {
+        k: v
+        for k, v in headers.items()
+        if k not in ("If-None-Match", "If-Modified-Since")
+    }
+    if validator is not None:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        headers["If-Range"] = validator
+    return headers
+
+
+class _DownloadSink:
+    """下载内容先写入内存，超过 spill_threshold 后转存到临时文件"""
+
+    def __init__(self, spill_threshold: int, probe_at: int):
+        self.spill_threshold = spill_threshold
+        # 下一次探测文件头的位置，0 表示已探测完
+        self.probe_at = probe_at
+        self._initial_probe_at = probe_at
+        self.buffer: Optional[io.BytesIO] = io.BytesIO()
+        self.temp_file = None
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        if self.temp_file is None and self.size + len(chunk) > self.spill_threshold:
+            # 超过阈值：把已下载内容转移到临时文件，后续直接写盘
+            self.temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".tmp")
+            self.temp_file.write(self.buffer.getbuffer())
+            self.buffer = None
+        if self.temp_file is not None:
+            self.temp_file.write(chunk)
+        else:
+            self.buffer.write(chunk)
+        self.size += len(chunk)
+
+    def reset(self):
+        """丢弃已收到的内容，从头重新下载"""
+        self.discard()
+        self.buffer = io.BytesIO()
+        self.size = 0
+        self.probe_at = self._initial_probe_at
+
+    def result(self) -> Union[bytes, str]:
+        """内存中的字节，或落盘后的临时文件路径"""
+        if self.temp_file is not None:
+            self.temp_file.close()
+            return self.temp_file.name
+        return self.buffer.getvalue()
+
+    def discard(self):
+        if self.temp_file is not None:
+            self.temp_file.close()
+            release_source(self.temp_file.name)
+            self.temp_file = None
+
+
+def release_source(source: Union[bytes, str, None]):
+    """释放 WebPConverter.download 返回的图片源：删除落盘的临时文件"""
+    if isinstance(source, str):
+        try:
+            os.unlink(source)
+        except Exception:
+            pass
+
+
+class ImageJob:
+    """流水线中的单张图片任务"""
+
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.url = url
+        # 图片源：内存中的字节，或文件路径（本地图片 / 超过阈值落盘的下载）
+        self.source: Union[bytes, str, None] = None
+        # 输出路径（不含扩展名），编码后按结果格式补上扩展名得到 output_path
+        self.output_stem: Optional[str] = None
+        self.output_path: Optional[str] = None
+        # 编码结果，写盘后交给上传阶段直接使用，上传完即释放
+        self.output_data: Optional[bytes] = None
+        self.is_temp = False
+        self.success = False
+        self.original_size = 0
+        self.converted_size = 0
+        self.remote_url: Optional[str] = None
+        # 编码信息：width、height、quality、method、encode_seconds、passthrough
+        self.encode_info: dict = {}
+        # 近似重复时指向文档中更靠前的同内容任务，直接复用它的输出与上传结果
+        self.duplicate_of: Optional["ImageJob"] = None
+        # 编码阶段结束（无论成败）时置位，近似重复任务据此等待首个任务的结果
+        self.encoded = threading.Event()
+        # 本任务写出的文件，编码后才被更靠前的同内容任务取代时删除
+        self.written: List[str] = []
+        # 响应式档位：width、height、path、size，上传前暂存 data，上传后记录 remote_url
+        self.variants: List[dict] = []
+        # 网络下载的字节数（本地图片为 0）与各阶段耗时(秒)：fetch、write、upload
+        self.bytes_fetched = 0
+        self.timings: Dict[str, float] = {}
+        # HTTP 缓存状态：miss、stored、revalidated（304，未重新传输），本地图片为 None
+        self.http_cache: Optional[str] = None
+
+    def reused_job(self) -> Optional["ImageJob"]:
+        """近似重复链上最靠前且编码成功的任务；没有时返回 None，使用本任务自己的输出"""
+        reused = None
+        job = self.duplicate_of
+        while job is not None:
+            if job.success:
+                reused = job
+            job = job.duplicate_of
+        return reused
+
+
+class ImagePipeline:
+    """
+    分阶段流水线：获取(线程池) → 编码(进程池) → 上传(线程池)
+
+    阶段之间通过有界队列连接，下游处理不过来时上游自动阻塞，
+    网络与 CPU 工作相互重叠，总耗时接近最慢阶段而不是各阶段之和。
+    """
+
+    def __init__(
+        self,
+        converter: WebPConverter,
+        output_dir: str,
+        fetch_workers: int = 8,
+        encode_workers: Optional[int] = None,
+        upload_workers: int = 4,
+        queue_size: Optional[int] = None,
+        uploader: Optional[Callable[[bytes, str], str]] = None,
+        progress_callback: Optional[Callable[[int, str], None]] = None,
+        time_budget: Optional[float] = None,
+        memory_budget: Optional[MemoryBudget] = None,
+        dedupe_threshold: Optional[int] = None,
+    ):
+        self.converter = converter
+        self.output_dir = output_dir
+        self.fetch_workers = max(1, fetch_workers)
+        self.encode_workers = max(1, encode_workers or default_encode_workers())
+        self.upload_workers = max(1, upload_workers)
+        # 队列容量默认为编码进程数的两倍，限制同时落盘的临时文件数量
+        self.queue_size = queue_size or self.encode_workers * 2
+        self.uploader = uploader
+        self.progress_callback = progress_callback
+        self._reserved_names: Set[str] = set()
+        self._lock = threading.Lock()
+        self._done = 0
+        self._total = 0
+        self._pool_broken = False
+        # 整篇文档的编码时间预算(秒)，按剩余图片数分摊给每张图片
+        self.time_budget = time_budget
+        self._deadline: Optional[float] = None
+        self._encode_started = 0
+        # 默认使用进程内共享的预算，多个并发转换合计不超过该预算
+        self.memory_budget = memory_budget or DECODE_MEMORY_BUDGET
+        # 近似重复检测：感知哈希汉明距离不超过阈值的图片只编码、上传一次
+        self.dedupe_index = (
+            PerceptualHashIndex(dedupe_threshold)
+            if dedupe_threshold is not None
+            else None
+        )
+        self._dedupe_lock = threading.Lock()
+
+    def _update_progress(self, message: str):
+        with self._lock:
+            self._done += 1
+            done = self._done
+            if self.progress_callback:
+                self.progress_callback(
+                    10 + done * 80 // max(1, self._total),
+                    f"{message} {done}/{self._total}",
+                )
+
+    def _fetch(self, job: ImageJob) -> bool:
+        """获取图片源：网络图片下载到内存（过大时落盘），内联 data URI 解码，本地图片直接使用"""
+        if is_data_uri(job.url):
+            if decode_data_uri is None:
+                return False
+            started_at = time.perf_counter()
             try:
-                os.unlink(temp_path)
-            except Exception:
-                pass
+                job.source = decode_data_uri(job.url)
+            except ValueError as e:
+                print(f"内联图片解码失败: {e}")
+                return False
+            job.timings["fetch"] = time.perf_counter() - started_at
+            job.output_stem = os.path.join(self.output_dir, self._reserve_name())
+            return True
+        if job.url.startswith(("http://", "https://")):
+            started_at = time.perf_counter()
+            job.source, fetch_info = self.converter.download_detailed(job.url)
+            job.timings["fetch"] = time.perf_counter() - started_at
+            if job.source is None:
+                return False
+            job.is_temp = isinstance(job.source, str)
+            job.bytes_fetched = fetch_info["bytes_fetched"]
+            job.http_cache = fetch_info["http_cache"]
+            job.output_stem = os.path.join(self.output_dir, self._reserve_name())
+            return True
+        if os.path.exists(job.url):
+            filename = os.path.splitext(os.path.basename(job.url))[0]
+            job.source = job.url
+            job.output_stem = os.path.join(self.output_dir, filename)
+            return True
+        return False
 
-            if success:
-                return output_path, original_size, converted_size
+    def _reserve_name(self) -> str:
+        """为网络图片与内联图片生成本次转换内不重复的文件名"""
+        with self._lock:
+            name = self.converter.new_image_name()
+            while name in self._reserved_names:
+                name = self.converter.new_image_name()
+            self._reserved_names.add(name)
+        return name
+
+    def _image_time_budget(self) -> Optional[float]:
+        """当前图片可用的编码时间：剩余时间按剩余图片数与编码并行度分摊"""
+        if self._deadline is None:
             return None
+        with self._lock:
+            remaining = max(1, self._total - self._encode_started)
+            self._encode_started += 1
+        seconds_left = max(0.0, self._deadline - time.perf_counter())
+        return seconds_left * self.encode_workers / remaining
+
+    def _encode_source(
+        self, job: ImageJob, time_budget: Optional[float]
+    ) -> Tuple[bytes, dict]:
+        """多进程时交给进程池，进程池不可用时在当前线程编码"""
+        if self.encode_workers > 1 and not self._pool_broken:
+            try:
+                # 子进程在 submit 时启动，启动失败（例如打包环境）抛出 RuntimeError / OSError
+                pool = _get_encode_pool(self.encode_workers)
+                future = pool.submit(
+                    self.converter.encode_webp_detailed,
+                    job.source,
+                    time_budget,
+                    True,
+                )
+            except (BrokenProcessPool, RuntimeError, OSError) as e:
+                self._disable_pool(e)
+            else:
+                try:
+                    # 单张图片的编码错误照常抛出，只让这张图片失败
+                    return future.result()
+                except BrokenProcessPool as e:
+                    # 子进程崩溃或模块无法被子进程导入
+                    self._disable_pool(e)
+        return self.converter.encode_webp_detailed(job.source, time_budget, True)
+
+    def _disable_pool(self, error: Exception):
+        """进程池不可用时本次转换的其余图片回退到串行编码"""
+        with self._lock:
+            if not self._pool_broken:
+                print(f"并行编码不可用，回退到串行编码: {error}")
+                self._pool_broken = True
+        _discard_encode_pool(self.encode_workers)
+
+    def _encode(self, job: ImageJob) -> bool:
+        try:
+            return self._encode_job(job)
+        finally:
+            job.encoded.set()
+
+    def _encode_job(self, job: ImageJob) -> bool:
+        """编码为 WebP（无收益时保留原图），按估算内存在预算内准入"""
+        try:
+            job.original_size = source_size(job.source)
+            time_budget = self._image_time_budget()
+            # 解码前按文件头估算内存，超出预算时等待，超大图片串行处理
+            memory = self.converter.estimate_memory(job.source)
+            with self.memory_budget.reserve(memory):
+                duplicate = self.dedupe_index is not None and self._find_duplicate(job)
+                if not duplicate:
+                    data, job.encode_info = self._encode_source(job, time_budget)
+            original = job.duplicate_of
+            if original is not None:
+                # 同内容图片编码成功才复用它的输出，失败时使用或补做自己的编码；
+                # 编码期间被文档中更靠前的同内容图片取代时同样等待它的结果
+                original.encoded.wait()
+                if job.reused_job() is not None:
+                    return False
+                job.duplicate_of = None
+                if duplicate:
+                    with self.memory_budget.reserve(memory):
+                        data, job.encode_info = self._encode_source(job, time_budget)
+            job.output_path = job.output_stem + job.encode_info["extension"]
+            write_started = time.perf_counter()
+            # 原样保留的本地图片若已在输出目录中则无需再写
+            if not (
+                isinstance(job.source, str)
+                and os.path.abspath(job.source) == os.path.abspath(job.output_path)
+            ):
+                with open(job.output_path, "wb") as f:
+                    f.write(data)
+                job.written.append(job.output_path)
+            for variant in job.encode_info.pop("variants", []):
+                variant_data = variant.pop("data")
+                variant["path"] = (
+                    f"{job.output_stem}-{variant['width']}w{variant['extension']}"
+                )
+                variant["size"] = len(variant_data)
+                with open(variant["path"], "wb") as f:
+                    f.write(variant_data)
+                job.written.append(variant["path"])
+                if self.uploader:
+                    variant["data"] = variant_data
+                job.variants.append(variant)
+            job.timings["write"] = time.perf_counter() - write_started
+        except Exception as e:
+            print(f"WebP转换失败: {e}")
+            return False
+        finally:
+            # 编码完成立即释放图片源
+            if job.is_temp:
+                release_source(job.source)
+            job.source = None
+
+        job.success = True
+        job.converted_size = len(data)
+        if self.uploader:
+            job.output_data = data
+        return True
 
+    def _find_duplicate(self, job: ImageJob) -> bool:
+        try:
+            fingerprint = image_fingerprint(job.source)
+        except Exception:
+            # 无法计算指纹的图片照常编码
+            return False
+        with self._dedupe_lock:
+            original = self.dedupe_index.find_or_add(fingerprint, job)
+            if original is not None and original.index > job.index:
+                # 文档中更靠前的图片取代已登记的图片，
+                # 复用哪张图片不取决于哪个编码线程先算出指纹
+                self.dedupe_index.replace(original, job, fingerprint)
+                original.duplicate_of = job
+                original = None
+            job.duplicate_of = original
+        return original is not None
+
+    def _upload(self, job: ImageJob) -> bool:
+        """上传主图及其响应式档位，任一档位失败时整张图片回退为本地路径"""
+        started_at = time.perf_counter()
+        try:
+            remote_url = self.uploader(
+                job.output_data, os.path.basename(job.output_path)
+            )
+            for variant in job.variants:
+                variant["remote_url"] = self.uploader(
+                    variant.pop("data"), os.path.basename(variant["path"])
+                )
+            job.remote_url = remote_url
         except Exception as e:
-            print(f"下载和转换失败: {e}")
-            return None
+            print(f"上传失败 {job.output_path}: {e}")
+            for variant in job.variants:
+                variant.pop("data", None)
+                variant.pop("remote_url", None)
+        finally:
+            job.output_data = None
+            job.timings["upload"] = time.perf_counter() - started_at
+        return True
+
+    def _run_stage(
+        self,
+        func: Callable[[ImageJob], bool],
+        message: str,
+        in_queue: "queue.Queue",
+        out_queue: Optional["queue.Queue"],
+    ):
+        while True:
+            job = in_queue.get()
+            if job is None:
+                return
+            try:
+                passed = func(job)
+            except Exception as e:
+                print(f"处理图片失败 {shorten_data_uri(job.url)}: {e}")
+                passed = False
+            if passed and out_queue is not None:
+                out_queue.put(job)
+            else:
+                self._update_progress(message)
+
+    def run(self, urls: List[str]) -> List[ImageJob]:
+        """运行流水线，返回与 urls 顺序一致的任务列表"""
+        jobs = [ImageJob(i, url) for i, url in enumerate(urls)]
+        self._total = len(jobs)
+        if self.time_budget is not None:
+            self._deadline = time.perf_counter() + self.time_budget
+        stages: List[Tuple[Callable[[ImageJob], bool], int, str]] = [
+            (self._fetch, self.fetch_workers, "获取失败"),
+            (self._encode, self.encode_workers, "编码图片"),
+        ]
+        if self.uploader:
+            stages.append((self._upload, self.upload_workers, "上传图片"))
+
+        # 第一个队列预先放入全部任务，其余队列有界
+        queues: List["queue.Queue"] = [queue.Queue()]
+        queues += [queue.Queue(maxsize=self.queue_size) for _ in stages[1:]]
+        for job in jobs:
+            queues[0].put(job)
+
+        threads: List[List[threading.Thread]] = []
+        for i, (func, workers, message) in enumerate(stages):
+            out_queue = queues[i + 1] if i + 1 < len(stages) else None
+            stage_threads = [
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(func, message, queues[i], out_queue),
+                    daemon=True,
+                )
+                for _ in range(workers)
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        # 逐个阶段收尾：上游全部结束后再通知下游退出
+        for i, stage_threads in enumerate(threads):
+            for _ in stage_threads:
+                queues[i].put(None)
+            for thread in stage_threads:
+                thread.join()
+
+        # 写盘后才被文档中更靠前的同内容图片取代的任务，其输出不会被引用；
+        # 同名本地图片的输出路径相同，仍被引用的文件保留
+        kept = {
+            path for job in jobs if job.reused_job() is None for path in job.written
+        }
+        for job in jobs:
+            if job.reused_job() is None:
+                continue
+            for path in job.written:
+                if path not in kept:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return jobs
+
+
+# 匹配 ![alt](url) 和 <img src="url"> 格式；允许 ] 与 ( 之间存在空格
+_IMAGE_LINK = re.compile(
+    r"(?:!\[(?P<alt>.*?)\]\s*\((?P<target>.*?)\))"
+    r"|(?:<img.*?src=[\"'](?P<src>[^\"']*)[\"'].*?>)"
+)
+# Markdown 图片链接中带标题的目标：url "title"、url 'title' 或 url (title)
+_TITLED_LINK = re.compile(r"""(.*?)\s+(?:"([^"]*)"|'([^']*)'|\(([^)]*)\))$""")
+
+
+def _link_url(match) -> Tuple[str, Optional[str]]:
+    """_IMAGE_LINK 匹配中的图片 url 与可选标题"""
+    if match.group("target") is None:
+        url, title = match.group("src").strip(), None
+    else:
+        url, title = match.group("target").strip(), None
+        # 去掉 ![alt](url "title") 中的可选标题
+        titled = _TITLED_LINK.match(url)
+        if titled:
+            url = titled.group(1)
+            title = next((t for t in titled.group(2, 3, 4) if t is not None), None)
+    # 允许 Markdown 形式 ![](<url with space>)，去除外围尖括号
+    if url.startswith("<") and url.endswith(">"):
+        url = url[1:-1].strip()
+    return url, title
 
 
 class MarkdownImageProcessor:
     """Markdown图片处理器"""
 
-    def __init__(self, webp_quality: int = 80):
-        self.webp_converter = WebPConverter(webp_quality)
+    def __init__(
+        self,
+        webp_quality: int = 80,
+        encode_workers: Optional[int] = None,
+        fetch_workers: int = 8,
+        upload_workers: int = 4,
+        target_bytes: Optional[int] = None,
+        min_ssim: Optional[float] = None,
+        min_psnr: Optional[float] = None,
+        effort: Union[str, int] = "auto",
+        time_budget: Optional[float] = None,
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None,
+        use_cache: bool = True,
+        dedupe_threshold: Optional[int] = None,
+        max_frames: Optional[int] = None,
+        max_fps: Optional[float] = None,
+        keep_alpha: bool = False,
+        alpha_quality: int = 100,
+        lossless: Union[str, bool] = "auto",
+        srcset_widths: Optional[Tuple[int, ...]] = None,
+        encoder: Union[str, Sequence[str]] = "webp",
+        download_segments: int = 1,
+    ):
+        # 设置 target_bytes / min_ssim / min_psnr 任一项后逐图搜索质量，webp_quality 不再生效
+        self.webp_converter = WebPConverter(
+            webp_quality,
+            target_bytes=target_bytes,
+            min_ssim=min_ssim,
+            min_psnr=min_psnr,
+            effort=effort,
+            max_width=max_width,
+            max_height=max_height,
+            use_cache=use_cache,
+            max_frames=max_frames,
+            max_fps=max_fps,
+            keep_alpha=keep_alpha,
+            alpha_quality=alpha_quality,
+            lossless=lossless,
+            # 设置后比主图窄的档位一并生成并上传，图片链接改写为 <img srcset> 标签
+            srcset_widths=srcset_widths,
+            # 多个编码器时逐图取最小的结果，例如 ("webp", "avif")
+            encoder=encoder,
+            # 大图拆成多段并行下载，适合单连接限速的图床
+            download_segments=download_segments,
+        )
+        # 整篇文档的编码时间预算(秒)，None 表示不限制；交互场景建议设置以保持响应
+        self.time_budget = time_budget
+        # 近似重复检测的汉明距离阈值（64 位 dHash，建议 0~8），None 表示关闭
+        self.dedupe_threshold = dedupe_threshold
         self.progress_callback: Optional[Callable[[int, str], None]] = None
+        # 并行编码的进程数，None 表示与 CPU 核数一致，1 表示在当前进程串行编码
+        self.encode_workers = encode_workers
+        # 并发下载与上传的线程数；每个主机的并发数另由主机调度器限制
+        self.fetch_workers = fetch_workers
+        self.upload_workers = upload_workers
 
     def set_quality(self, quality: int):
         """设置WebP质量"""
@@ -213,27 +2323,25 @@ class MarkdownImageProcessor:
 
     def find_image_links(self, markdown_text: str) -> List[str]:
         """查找Markdown中的所有图片链接"""
-        # 匹配 ![alt](url) 和 <img src="url"> 格式；允许 ] 与 ( 之间存在空格
-        pattern = r'(?:!\[.*?\]\s*\((.*?)\))|(?:<img.*?src=["\']([^"\']*)["\'].*?>)'
-        matches = re.findall(pattern, markdown_text)
-
-        # 提取非空的URL
+        # 内联的 base64 data URI 先换成占位符，正则不会在 MB 级的编码内容上回溯
+        data_uris: List[str] = []
+        if mask_data_uris is not None:
+            markdown_text, data_uris = mask_data_uris(markdown_text)
         urls = []
-        for match in matches:
-            url = match[0] or match[1]  # 取第一个非空的组
-            if not url:
-                continue
-            candidate = url.strip()
-            # 允许 Markdown 形式 ![](<url with space>)，去除外围尖括号
-            if candidate.startswith("<") and candidate.endswith(">"):
-                candidate = candidate[1:-1].strip()
-            if candidate:
-                urls.append(candidate)
+        for match in _IMAGE_LINK.finditer(markdown_text):
+            url, _ = _link_url(match)
+            if data_uris:
+                url = unmask_data_uris(url, data_uris)
+            if url:
+                urls.append(url)
 
         return urls
 
     def process_markdown(
-        self, markdown_text: str, output_dir: str = "images"
+        self,
+        markdown_text: str,
+        output_dir: str = "images",
+        uploader: Optional[Callable[[bytes, str], str]] = None,
     ) -> Tuple[str, int, dict]:
         """
         处理Markdown文本，转换图片为WebP格式
@@ -241,6 +2349,8 @@ class MarkdownImageProcessor:
         Args:
             markdown_text: Markdown文本内容
             output_dir: 图片输出目录
+            uploader: 可选的上传函数 (WebP字节, 文件名) -> 远程URL；
+                传入后每张图片编码完成即上传，Markdown 中直接写入远程URL
 
         Returns:
             Tuple[新的Markdown文本, 转换成功的图片数量, 压缩统计信息]
@@ -266,63 +2376,119 @@ class MarkdownImageProcessor:
 
         self._update_progress(10, f"找到 {len(image_urls)} 个图片链接")
 
+        pipeline = ImagePipeline(
+            self.webp_converter,
+            output_dir,
+            fetch_workers=self.fetch_workers,
+            encode_workers=self.encode_workers,
+            upload_workers=self.upload_workers,
+            uploader=uploader,
+            progress_callback=self.progress_callback,
+            time_budget=self.time_budget,
+            dedupe_threshold=self.dedupe_threshold,
+        )
+        jobs = pipeline.run(image_urls)
+
+        # 按原顺序回写 Markdown
         new_markdown = markdown_text
+        # 原 url -> (新链接, srcset 候选)，同一 url 出现多次时取第一个成功的任务
+        links: Dict[str, Tuple[str, Optional[List[Tuple[str, int]]]]] = {}
         success_count = 0
+        uploaded_count = 0
+        upload_failed_count = 0
         total_original_size = 0
         total_converted_size = 0
+        passthrough_count = 0
+        cache_hits = 0
+        duplicate_count = 0
+        lossless_count = 0
+        total_bytes_fetched = 0
+        http_revalidated = 0
+        images = []
 
-        for i, url in enumerate(image_urls):
-            try:
-                progress = 10 + (i * 80 // len(image_urls))
-                self._update_progress(progress, f"处理图片 {i+1}/{len(image_urls)}")
-
-                if url.startswith(("http://", "https://")):
-                    # 网络图片：下载并转换
-                    result = self.webp_converter.download_and_convert(url, output_dir)
-                    if result:
-                        webp_path, original_size, converted_size = result
-                        # 计算相对路径
-                        relative_path = os.path.relpath(
-                            webp_path, os.path.dirname(output_dir)
-                        )
-                        relative_path = relative_path.replace(
-                            "\\", "/"
-                        )  # 统一使用正斜杠
-
-                        # 替换Markdown中的链接（同时处理可能存在的尖括号包裹形式）
-                        for old in (f"<{url}>", url):
-                            new_markdown = new_markdown.replace(old, relative_path)
-                        success_count += 1
-                        total_original_size += original_size
-                        total_converted_size += converted_size
-
-                elif os.path.exists(url):
-                    # 本地图片：直接转换
-                    filename = os.path.splitext(os.path.basename(url))[0]
-                    webp_path = os.path.join(output_dir, f"{filename}.webp")
-
-                    (
-                        success,
-                        original_size,
-                        converted_size,
-                    ) = self.webp_converter.convert_to_webp(url, webp_path)
-                    if success:
-                        # 计算相对路径
-                        relative_path = os.path.relpath(
-                            webp_path, os.path.dirname(output_dir)
-                        )
-                        relative_path = relative_path.replace("\\", "/")
+        for job in jobs:
+            # 近似重复的图片复用文档中最靠前的同内容图片的输出，不产生新文件
+            result = job.reused_job() or job
+            if not result.success:
+                continue
 
-                        # 替换Markdown中的链接（同时处理可能存在的尖括号包裹形式）
-                        for old in (f"<{url}>", url):
-                            new_markdown = new_markdown.replace(old, relative_path)
-                        success_count += 1
-                        total_original_size += original_size
-                        total_converted_size += converted_size
+            if result.remote_url:
+                new_path = result.remote_url
+                uploaded_count += job is result
+            else:
+                upload_failed_count += job is result
+                new_path = self._relative_link(result.output_path, output_dir)
 
-            except Exception as e:
-                print(f"处理图片失败 {url}: {e}")
-                continue
+            candidates = None
+            if result.variants:
+                candidates = [(new_path, result.encode_info.get("width"))]
+                for variant in result.variants:
+                    candidates.append(
+                        (
+                            variant.get("remote_url")
+                            or self._relative_link(variant["path"], output_dir),
+                            variant["width"],
+                        )
+                    )
+            links.setdefault(job.url, (new_path, candidates))
+            success_count += 1
+            # 近似重复的图片不计编码、写盘、上传的耗时与输出体积；编码后才被
+            # 更靠前的图片取代的任务也一样，统计不随线程的先后变化
+            own = job is result
+            info = job.encode_info if own else {}
+            timings = job.timings if own else {"fetch": job.timings.get("fetch", 0)}
+            converted_size = job.converted_size if own else 0
+            variants = job.variants if own else []
+            total_original_size += job.original_size
+            total_converted_size += converted_size
+            duplicate_count += not own
+            passthrough = info.get("passthrough", False)
+            passthrough_count += passthrough
+            cache_hit = info.get("cache_hit", False)
+            cache_hits += cache_hit
+            mode = info.get("mode")
+            lossless_count += mode == "lossless"
+            total_bytes_fetched += job.bytes_fetched
+            http_revalidated += job.http_cache == "revalidated"
+            decode_seconds = info.get("decode_seconds", 0)
+            encode_seconds = info.get("encode_seconds", 0)
+            images.append(
+                {
+                    "url": shorten_data_uri(job.url),
+                    "original_size": job.original_size,
+                    "converted_size": converted_size,
+                    "size_delta": job.original_size - converted_size,
+                    # 各阶段耗时：下载、解码、编码（不含解码）、写盘、上传
+                    "bytes_fetched": job.bytes_fetched,
+                    "http_cache": job.http_cache,
+                    "fetch_ms": timings.get("fetch", 0) * 1000,
+                    "decode_ms": decode_seconds * 1000,
+                    "encode_ms": (encode_seconds - decode_seconds) * 1000,
+                    "write_ms": timings.get("write", 0) * 1000,
+                    "upload_ms": timings.get("upload", 0) * 1000,
+                    # 写出的总字节数，包含响应式档位
+                    "output_bytes": converted_size + sum(v["size"] for v in variants),
+                    "width": info.get("width"),
+                    "height": info.get("height"),
+                    "original_width": info.get("original_width"),
+                    "original_height": info.get("original_height"),
+                    "quality": info.get("quality"),
+                    "method": info.get("method"),
+                    "frames": info.get("frames", 1),
+                    # 静态图片最终采用的编码方式：lossy / lossless
+                    "mode": mode,
+                    "encoder": info.get("encoder"),
+                    "passthrough": passthrough,
+                    "cache_hit": cache_hit,
+                    "duplicate_of": None if own else shorten_data_uri(result.url),
+                    "variants": [
+                        {"width": v["width"], "size": v["size"]}
+                        for v in result.variants
+                    ],
+                }
+            )
+
+        new_markdown = self._rewrite_links(new_markdown, links)
 
         # 计算压缩比例
         compression_ratio = 0
@@ -336,11 +2502,97 @@ class MarkdownImageProcessor:
             "total_converted_size": total_converted_size,
             "compression_ratio": compression_ratio,
             "size_saved": total_original_size - total_converted_size,
+            # 原样保留（已是最优或重新编码反而变大）的图片数，也计入成功数与体积统计
+            "passthrough_count": passthrough_count,
+            # 直接使用编码缓存结果的图片数
+            "cache_hits": cache_hits,
+            # 与前面图片近似重复、直接复用其输出的图片数
+            "duplicate_count": duplicate_count,
+            # 无损编码比有损更小而采用无损结果的图片数
+            "lossless_count": lossless_count,
+            "total_bytes_fetched": total_bytes_fetched,
+            # 服务端返回 304、直接使用 HTTP 缓存内容的图片数
+            "http_revalidated": http_revalidated,
+            # 各阶段耗时的 p50 / p90 / p99 / max (ms)，近似重复的图片不计入
+            "stage_percentiles": stage_percentiles(
+                [image for image in images if not image["duplicate_of"]]
+            ),
+            # 每张图片的各阶段耗时与体积变化
+            "images": images,
         }
+        if uploader:
+            compression_stats["uploaded_count"] = uploaded_count
+            # 上传失败、Markdown 中仍为本地路径的图片数
+            compression_stats["upload_failed_count"] = upload_failed_count
 
         self._update_progress(100, f"转换完成！成功转换 {success_count} 张图片")
         return new_markdown, success_count, compression_stats
 
+    @staticmethod
+    def _relative_link(path: str, output_dir: str) -> str:
+        """输出文件相对于 Markdown 所在目录的链接"""
+        # 计算相对路径
+        link = os.path.relpath(path, os.path.dirname(output_dir))
+        return link.replace("\\", "/")  # 统一使用正斜杠
+
+    @staticmethod
+    def _rewrite_links(
+        markdown_text: str,
+        links: Dict[str, Tuple[str, Optional[List[Tuple[str, int]]]]],
+    ) -> str:
+        """
+        一次遍历改写全部图片链接，links 为原 url -> (新链接, srcset 候选)
+
+        只改写匹配到的链接目标且每处只改写一次，新链接中包含原 url 时
+        （例如原样保留的 pic.webp 改写为 images/pic.webp）也不会被再次替换。
+        srcset 候选为 (链接, 宽度)，第一项是主图，作为不支持 srcset 时的 src；
+        有候选时 ![alt](url "title") 整体改写为 <img>（标题保留为 title 属性），
+        已有的 <img src="url"> 则补上 srcset 属性
+        """
+        data_uris: List[str] = []
+        if mask_data_uris is not None:
+            markdown_text, data_uris = mask_data_uris(markdown_text)
+
+        def rewrite(match) -> str:
+            url, title = _link_url(match)
+            link = links.get(unmask_data_uris(url, data_uris) if data_uris else url)
+            if link is None:
+                return match.group(0)
+            new_path, candidates = link
+            srcset = None
+            if candidates:
+                srcset = ", ".join(
+                    f"{path} {width}w"
+                    for path, width in sorted(candidates, key=lambda c: c[1])
+                )
+            text = match.string
+            if match.group("target") is None:
+                # <img src="url">：替换 src 的值，有候选时在其后补上 srcset
+                start, end = match.span("src")
+                tail = text[end : match.end()]
+                if srcset is not None:
+                    tail = f'{tail[0]} srcset="{srcset}"{tail[1:]}'
+                return text[match.start() : start] + new_path + tail
+            if srcset is not None:
+                alt = html.escape(match.group("alt"), quote=True)
+                tag = f'<img src="{new_path}" srcset="{srcset}" alt="{alt}"'
+                if title is not None:
+                    tag += f' title="{html.escape(title, quote=True)}"'
+                return tag + ">"
+            start, end = match.span("target")
+            target = match.group("target")
+            # 同时处理可能存在的尖括号包裹形式
+            bracketed = f"<{url}>"
+            target = target.replace(
+                bracketed if bracketed in target else url, new_path, 1
+            )
+            return text[match.start() : start] + target + text[end : match.end()]
+
+        markdown_text = _IMAGE_LINK.sub(rewrite, markdown_text)
+        if data_uris:
+            markdown_text = unmask_data_uris(markdown_text, data_uris)
+        return markdown_text
+
 
 # 为了向后兼容，提供简化的接口
 def convert_markdown_images(
@@ -348,6 +2600,11 @@ def convert_markdown_images(
     output_dir: str = "images",
     quality: int = 80,
     progress_callback: Optional[Callable[[int, str], None]] = None,
+    uploader: Optional[Callable[[bytes, str], str]] = None,
+    time_budget: Optional[float] = None,
+    max_width: Optional[int] = None,
+    max_height: Optional[int] = None,
+    upload_workers: Optional[int] = None,
 ) -> Tuple[str, int, dict]:
     """
     转换Markdown中的图片为WebP格式
@@ -357,12 +2614,21 @@ def convert_markdown_images(
         output_dir: 输出目录
         quality: WebP质量 (1-100)
         progress_callback: 进度回调函数
+        uploader: 可选的上传函数，传入后转换与上传以流水线方式同时进行
+        time_budget: 整篇文档的编码时间预算(秒)，超出预算的大图自动降低编码强度
+        max_width: 最大宽度，超出时等比缩小
+        max_height: 最大高度，超出时等比缩小
+        upload_workers: 同时上传的图片数，默认 4；图床不支持并发上传时传 1
 
     Returns:
         Tuple[新的Markdown文本, 成功转换的图片数量, 压缩统计信息]
     """
-    processor = MarkdownImageProcessor(quality)
+    processor = MarkdownImageProcessor(
+        quality, time_budget=time_budget, max_width=max_width, max_height=max_height
+    )
+    if upload_workers:
+        processor.upload_workers = upload_workers
     if progress_callback:
         processor.set_progress_callback(progress_callback)
 
-    return processor.process_markdown(markdown_text, output_dir)
+    return processor.process_markdown(markdown_text, output_dir, uploader)
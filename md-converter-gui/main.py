@@ -60,4 +60,8 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包环境下图片编码进程池需要 freeze_support 才能启动子进程
+    import multiprocessing
+
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试近似重复图片总是复用文档中最靠前的图片
+"""
+
+import os
+import time
+
+from core import image_converter
+from core.image_converter import MarkdownImageProcessor
+from PIL import Image, ImageDraw
+
+
+def _screenshot(path_png: str, path_jpg: str):
+    img = Image.new("RGB", (600, 400), (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    for y in range(0, 400, 20):
+        draw.text((10, y), "screenshot text line %d" % y, fill=(0, 0, 0))
+    draw.rectangle([300, 50, 550, 250], fill=(30, 120, 200))
+    img.save(path_png)
+    img.save(path_jpg, quality=70)
+
+
+def test_earliest_link_wins(tmp_path, monkeypatch):
+    png = str(tmp_path / "shot.png")
+    jpg = str(tmp_path / "resaved.jpg")
+    _screenshot(png, jpg)
+
+    # 第一张图片最后才下载完成，第二张先登记指纹
+    fetch = image_converter.ImagePipeline._fetch
+
+    def slow_first(self, job):
+        if job.index == 0:
+            time.sleep(0.5)
+        return fetch(self, job)
+
+    monkeypatch.setattr(image_converter.ImagePipeline, "_fetch", slow_first)
+
+    processor = MarkdownImageProcessor(
+        80, encode_workers=1, dedupe_threshold=6, use_cache=False
+    )
+    output_dir = str(tmp_path / "images")
+    markdown, count, stats = processor.process_markdown(
+        f"![a]({png})\n![b]({jpg})", output_dir
+    )
+
+    first, second = stats["images"]
+    assert count == 2
+    assert stats["duplicate_count"] == 1
+    assert first["duplicate_of"] is None
+    assert second["duplicate_of"] == png
+    assert markdown == "![a](images/shot.webp)\n![b](images/shot.webp)"
+    # 被取代的第二张图片的输出已删除
+    assert os.listdir(output_dir) == ["shot.webp"]
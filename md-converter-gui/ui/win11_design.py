@@ -70,10 +70,11 @@ current_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(current_dir))
 
 try:
-    from core.image_converter import convert_markdown_images
+    from core.image_converter import convert_markdown_images, output_extensions
 except ImportError:
     print("Warning: 无法导入图片转换模块")
     convert_markdown_images = None
+    output_extensions = None
 
 from .components.control_panel import Win11ControlPanel
 from .components.markdown_editor import Win11MarkdownEditor
@@ -966,6 +967,31 @@ class Win11ControlPanel(QWidget):
         )
         stats_layout.addWidget(self.compression_ratio_label)
 
+        # 各阶段耗时 p90 与最慢的图片
+        self.stage_timing_label = QLabel("耗时 p90: --")
+        self.stage_timing_label.setWordWrap(True)
+        self.stage_timing_label.setStyleSheet(
+            """
+            QLabel {
+                font-size: 12px;
+                color: #605e5c;
+            }
+        """
+        )
+        stats_layout.addWidget(self.stage_timing_label)
+
+        self.slowest_image_label = QLabel("最慢图片: --")
+        self.slowest_image_label.setWordWrap(True)
+        self.slowest_image_label.setStyleSheet(
+            """
+            QLabel {
+                font-size: 12px;
+                color: #605e5c;
+            }
+        """
+        )
+        stats_layout.addWidget(self.slowest_image_label)
+
         stats_container.setLayout(stats_layout)
         layout.addWidget(stats_container)
 
@@ -989,6 +1015,34 @@ class Win11ControlPanel(QWidget):
         self.saved_size_label.setText(f"节省空间: {_fmt(saved_size)}")
         self.compression_ratio_label.setText(f"压缩比例: {compression_ratio:.1f}%")
 
+        stages = (
+            ("fetch_ms", "下载"),
+            ("decode_ms", "解码"),
+            ("encode_ms", "编码"),
+            ("write_ms", "写盘"),
+        )
+        percentiles = stats.get("stage_percentiles")
+        if percentiles:
+            self.stage_timing_label.setText(
+                "耗时 p90: "
+                + " · ".join(
+                    f"{name} {percentiles[key]['p90']:.0f}ms" for key, name in stages
+                )
+            )
+
+        def total_ms(image):
+            return sum(image.get(key, 0) for key, _ in stages)
+
+        images = stats.get("images") or []
+        if images:
+            # 下载到写盘总耗时最长的图片，便于发现慢的图床或过大的图片
+            slowest = max(images, key=total_ms)
+            name = slowest["url"].rsplit("/", 1)[-1] or slowest["url"]
+            size = slowest.get("bytes_fetched") or slowest.get("original_size", 0)
+            self.slowest_image_label.setText(
+                f"最慢图片: {name} {total_ms(slowest):.0f}ms, {_fmt(size)}"
+            )
+
     def reset_compression_stats(self):
         """重置压缩统计信息"""
         if hasattr(self, "original_size_label"):
@@ -999,6 +1053,10 @@ class Win11ControlPanel(QWidget):
             self.saved_size_label.setText("节省空间: --")
         if hasattr(self, "compression_ratio_label"):
             self.compression_ratio_label.setText("压缩比例: --")
+        if hasattr(self, "stage_timing_label"):
+            self.stage_timing_label.setText("耗时 p90: --")
+        if hasattr(self, "slowest_image_label"):
+            self.slowest_image_label.setText("最慢图片: --")
 
     def on_quality_changed(self, value):
         """质量滑块值改变"""
@@ -1798,14 +1856,17 @@ class Win11MainWindow(QMainWindow):
         self.real_conversion()
 
     def on_upload_clicked(self):
-        """手动上传：把 images 下的 webp 上传并回写远程 URL"""
+        """手动上传：把 images 下转换输出的图片上传并回写远程 URL"""
         try:
             self.start_upload(silent=False)
         except Exception as e:
             QMessageBox.critical(self, "上传失败", str(e))
 
-    def start_upload(self, silent: bool = True):
-        """启动上传流程；silent=True 时不弹窗，仅更新编辑器与状态栏"""
+    def start_upload(self, silent: bool = True, only_referenced: bool = False):
+        """
+        启动上传流程；silent=True 时不弹窗，仅更新编辑器与状态栏；
+        only_referenced=True 时只上传 Markdown 中仍以本地路径引用的图片
+        """
         base_dir = (
             os.path.dirname(self.current_file)
             if getattr(self, "current_file", None)
@@ -1824,23 +1885,28 @@ class Win11MainWindow(QMainWindow):
                     self, "提示", "未找到 images 目录，请先执行转换。"
                 )
             return
-        local_webps = [
+        # 除 WebP 外还可能输出 AVIF / JXL，或原样保留的 jpg / png / gif；
+        # 后者可能是用户自己放在 images 下的原图，只上传 Markdown 中引用到的
+        extensions = output_extensions() if output_extensions else (".webp",)
+        markdown_text = self.editor.toPlainText()
+        local_images = [
             os.path.join(img_dir, n)
             for n in os.listdir(img_dir)
-            if n.lower().endswith(".webp")
+            if (n.lower().endswith(".webp") and not only_referenced)
+            or (n.lower().endswith(extensions) and f"images/{n}" in markdown_text)
         ]
         try:
             print(
-                f"[GUI] start_upload: found {len(local_webps)} webp files", flush=True
+                f"[GUI] start_upload: found {len(local_images)} image files", flush=True
             )
         except Exception:
             pass
-        if not local_webps:
+        if not local_images:
             if not silent:
-                QMessageBox.information(self, "提示", "没有可上传的 WebP 文件。")
+                QMessageBox.information(self, "提示", "没有可上传的图片文件。")
             return
         self.status_label.setText("正在上传...")
-        self.upload_worker = UploadWorker(base_dir, local_webps)
+        self.upload_worker = UploadWorker(base_dir, local_images)
         self.upload_worker.progress_updated.connect(self.on_conversion_progress)
         try:
             print("[GUI] upload worker created", flush=True)
@@ -1855,20 +1921,9 @@ class Win11MainWindow(QMainWindow):
             if not silent:
                 # 合并流程下的统一弹窗在上传完成后显示
                 if self._combined_flow:
-                    cnt = self._last_convert_count
-                    stats = self._last_convert_stats or {}
-                    from .utils import format_size_human as format_size
-
-                    original_size = stats.get("total_original_size", 0)
-                    saved_size = stats.get("size_saved", 0)
-                    compression_ratio = stats.get("compression_ratio", 0)
-                    msg = f"成功转换并上传 {cnt} 张图片！\n\n"
-                    if original_size > 0:
-                        msg += f"原始大小: {format_size(original_size)}\n"
-                        msg += f"节省空间: {format_size(saved_size)}\n"
-                        msg += f"压缩比例: {compression_ratio:.1f}%\n\n"
-                    msg += "图片已保存到 images 目录并替换为外链。"
-                    QMessageBox.information(self, "完成", msg)
+                    self._show_combined_result(
+                        self._last_convert_count, self._last_convert_stats or {}
+                    )
                     self._combined_flow = False
                 else:
                     QMessageBox.information(
@@ -1884,6 +1939,21 @@ class Win11MainWindow(QMainWindow):
             )
         self.upload_worker.start()
 
+    def _show_combined_result(self, count: int, stats: dict):
+        """合并流程（转换 + 上传）结束后的统一弹窗"""
+        from .utils import format_size_human as format_size
+
+        original_size = stats.get("total_original_size", 0)
+        saved_size = stats.get("size_saved", 0)
+        compression_ratio = stats.get("compression_ratio", 0)
+        msg = f"成功转换并上传 {count} 张图片！\n\n"
+        if original_size > 0:
+            msg += f"原始大小: {format_size(original_size)}\n"
+            msg += f"节省空间: {format_size(saved_size)}\n"
+            msg += f"压缩比例: {compression_ratio:.1f}%\n\n"
+        msg += "图片已保存到 images 目录并替换为外链。"
+        QMessageBox.information(self, "完成", msg)
+
     # === 内置一份转换实现，确保方法存在于类上（避免外部重复定义导致找不到） ===
     def real_conversion(self):
         """真正的图片转换过程（类内实现）"""
@@ -1933,8 +2003,13 @@ class Win11MainWindow(QMainWindow):
         self.control_panel.convert_btn.setEnabled(False)
         self.control_panel.convert_btn.setText("转换中...")
 
-        # 线程执行
-        self.conversion_worker = ConversionWorker(markdown_text, output_dir, quality)
+        # 线程执行：合并流程下转换与上传以流水线方式同时进行
+        self.conversion_worker = ConversionWorker(
+            markdown_text,
+            output_dir,
+            quality,
+            upload=getattr(self, "_combined_flow", False),
+        )
         self.conversion_worker.progress_updated.connect(self.on_conversion_progress)
         self.conversion_worker.conversion_finished.connect(self.on_conversion_finished)
         self.conversion_worker.conversion_error.connect(self.on_conversion_error)
@@ -1994,10 +2069,23 @@ class Win11MainWindow(QMainWindow):
                 )
                 self._combined_flow = False
                 return
+            # 流水线已在转换过程中完成上传，直接统一提示；
+            # 有图片上传失败时仍走单独的上传步骤，补传仍为本地链接的图片
+            if stats.get("uploaded_count") and not stats.get("upload_failed_count"):
+                self._combined_flow = False
+                self.status_label.setText("上传完成")
+                self._show_combined_result(count, stats)
+                return
             # 触发上传
+            only_referenced = bool(stats.get("upload_failed_count"))
             try:
                 self.status_label.setText("转换完成，准备上传...")
-                QTimer.singleShot(0, lambda: self.start_upload(silent=False))
+                QTimer.singleShot(
+                    0,
+                    lambda: self.start_upload(
+                        silent=False, only_referenced=only_referenced
+                    ),
+                )
             except Exception:
                 pass
             return
@@ -13,18 +13,40 @@ except Exception:
     convert_markdown_images = None
 
 
+def _resolve_upload_adapter():
+    """获取图床适配器：优先已启用的配置，其次任意已配置的图床"""
+    if UploadManager is None:
+        return None
+    um = UploadManager()
+    adapter = um.get_adapter_if_enabled()
+    # 回退：若未显式启用但已配置图床，则也允许上传
+    if adapter is None:
+        try:
+            adapter = um.get_adapter()
+        except Exception:
+            adapter = None
+    return adapter
+
+
 class ConversionWorker(QThread):
     """图片转换工作线程"""
 
+    # 交互转换的编码时间预算(秒)，超大截图自动降低编码强度以保持界面响应
+    TIME_BUDGET = 10.0
+
     progress_updated = pyqtSignal(int, str)
     conversion_finished = pyqtSignal(str, int, dict)  # new_md, count, stats
     conversion_error = pyqtSignal(str)
 
-    def __init__(self, markdown_text: str, output_dir: str, quality: int):
+    def __init__(
+        self, markdown_text: str, output_dir: str, quality: int, upload: bool = False
+    ):
         super().__init__()
         self.markdown_text = markdown_text
         self.output_dir = output_dir
         self.quality = quality
+        # 为 True 时每张图片编码完成即上传（流水线），统计中带 uploaded_count
+        self.upload = upload
 
     def run(self):
         try:
@@ -35,11 +57,23 @@ class ConversionWorker(QThread):
             def progress_callback(progress: int, message: str):
                 self.progress_updated.emit(progress, message)
 
+            uploader = None
+            upload_workers = None
+            if self.upload:
+                adapter = _resolve_upload_adapter()
+                if adapter is not None:
+                    uploader = adapter.upload_bytes
+                    # 图床可限制并发上传数（例如 GitHub 只能逐个提交）
+                    upload_workers = getattr(adapter, "max_concurrent_uploads", None)
+
             new_markdown, count, stats = convert_markdown_images(
                 self.markdown_text,
                 self.output_dir,
                 self.quality,
                 progress_callback,
+                uploader,
+                self.TIME_BUDGET,
+                upload_workers=upload_workers,
             )
             self.conversion_finished.emit(new_markdown, count, stats)
         except Exception as e:
@@ -67,14 +101,7 @@ class UploadWorker(QThread):
                     pass
                 self.finished_with_mapping.emit({})
                 return
-            um = UploadManager()
-            adapter = um.get_adapter_if_enabled()
-            # 回退：若未显式启用但已配置图床，则也允许上传
-            if adapter is None:
-                try:
-                    adapter = um.get_adapter()
-                except Exception:
-                    adapter = None
+            adapter = _resolve_upload_adapter()
             if adapter is None:
                 try:
                     print("[Worker] No adapter available", flush=True)
@@ -16,6 +16,9 @@ except ImportError:
 class GitHubAdapter:
     """GitHub仓库上传适配器（GUI版本）"""
 
+    # 同一分支的并发提交会被 GitHub 以 409 拒绝，只能逐个上传
+    max_concurrent_uploads = 1
+
     def __init__(
         self,
         token: str,
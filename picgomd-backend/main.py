@@ -8,12 +8,13 @@ Picgo.MD Backend API Server
 import asyncio
 import json
 import os
+import re
 import shutil
 import sys
 import tempfile
 import uuid
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional, Union
 
 import requests
 import uvicorn
@@ -28,7 +29,7 @@ from fastapi import (
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
 from starlette.middleware.base import BaseHTTPMiddleware
 
 try:
@@ -65,6 +66,7 @@ if str(project_root) not in sys.path:
 
 # 导入现有的图片转换模块（兼容含连字符的目录名）
 MarkdownImageProcessor = None
+output_extensions = None
 UploadManager = None
 GitHubAdapter = None
 AliOssAdapter = None
@@ -75,6 +77,7 @@ S3Adapter = None
 try:
     # 首先尝试常规包名（如果你未来把目录重命名为 md_converter_gui 可直接生效）
     from md_converter_gui.core.image_converter import MarkdownImageProcessor as _MIP
+    from md_converter_gui.core.image_converter import output_extensions as _OE
     from md_converter_gui.uploader.ali_oss_adapter import AliOssAdapter as _ALI
     from md_converter_gui.uploader.cos_adapter import CosAdapter as _COS
     from md_converter_gui.uploader.github_adapter import GitHubAdapter as _GH
@@ -83,6 +86,7 @@ try:
     from md_converter_gui.uploader.s3_adapter import S3Adapter as _S3
 
     MarkdownImageProcessor = _MIP
+    output_extensions = _OE
     UploadManager = _UM
     GitHubAdapter = _GH
     AliOssAdapter = _ALI
@@ -101,7 +105,15 @@ except Exception as e:
             spec = _importlib_util.spec_from_file_location(mod_name, str(file_path))
             if spec and spec.loader:
                 module = _importlib_util.module_from_spec(spec)
-                spec.loader.exec_module(module)
+                # 注册模块并加入搜索路径：编码进程池的子进程需要按模块名导入任务函数
+                sys.modules[mod_name] = module
+                if str(file_path.parent) not in sys.path:
+                    sys.path.append(str(file_path.parent))
+                try:
+                    spec.loader.exec_module(module)
+                except Exception:
+                    sys.modules.pop(mod_name, None)
+                    raise
                 return module
         except Exception as _e:
             print(f"Warning: dynamic import failed for {file_path}: {_e}")
@@ -152,6 +164,7 @@ except Exception as e:
     try:
         if img_conv_mod and hasattr(img_conv_mod, "MarkdownImageProcessor"):
             MarkdownImageProcessor = getattr(img_conv_mod, "MarkdownImageProcessor")
+            output_extensions = getattr(img_conv_mod, "output_extensions", None)
         # 不再设置 UploadManager，统一通过各云适配器直接上传
         if github_adapter_mod and hasattr(github_adapter_mod, "GitHubAdapter"):
             GitHubAdapter = getattr(github_adapter_mod, "GitHubAdapter")
@@ -166,17 +179,22 @@ except Exception as e:
     except Exception as e2:
         print(f"Warning: Could not set conversion classes: {e2}")
 
+# 转换可能写出的图片扩展名（各编码器的输出格式与原样保留的格式），上传时据此收集本地文件
+OUTPUT_EXTENSIONS = tuple(output_extensions()) if output_extensions else (".webp",)
+OUTPUT_EXTENSION_PATTERN = (
+    "(?:" + "|".join(re.escape(ext) for ext in OUTPUT_EXTENSIONS) + ")"
+)
+
 # 最后兜底：若仍未获得 MarkdownImageProcessor，则提供一个最小可用实现
 if MarkdownImageProcessor is None:
     print("Warning: using built-in fallback MarkdownImageProcessor")
     import io
-    import re
 
     import requests as _req
     from PIL import Image
 
     class _FallbackProcessor:
-        def __init__(self, webp_quality: int = 80):
+        def __init__(self, webp_quality: int = 80, **_unsupported):
             self.quality = max(1, min(100, int(webp_quality)))
             self._cb = None
 
@@ -359,10 +377,48 @@ def _normalize_ali_endpoint(endpoint: Optional[str]) -> Optional[str]:
         return endpoint
 
 
+def _camel_keys(value):
+    """递归地把字典键从下划线命名转换为小驼峰"""
+    if isinstance(value, dict):
+        return {
+            re.sub(r"_([a-z0-9])", lambda m: m.group(1).upper(), key): _camel_keys(v)
+            for key, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_camel_keys(v) for v in value]
+    return value
+
+
 # 数据模型
 class ConversionRequest(BaseModel):
     markdown: str
     quality: int = 73
+    # 按目标逐图搜索质量（任选其一或组合），设置后 quality 不再生效
+    target_bytes: Optional[int] = None
+    min_ssim: Optional[float] = None
+    min_psnr: Optional[float] = None
+    # 编码强度："auto"（默认）、"max" 或 0~6；time_budget 为整篇文档的编码时间预算(秒)
+    effort: Optional[Union[Literal["auto", "max"], conint(ge=0, le=6)]] = None
+    time_budget: Optional[float] = None
+    # 最大宽高，超出时等比缩小
+    max_width: Optional[int] = None
+    max_height: Optional[int] = None
+    # 是否复用磁盘上的编码结果缓存（与桌面端共用）
+    use_cache: bool = True
+    # 近似重复图片检测的汉明距离阈值（建议 0~8），不传表示关闭
+    dedupe_threshold: Optional[int] = None
+    # 动图最多保留的帧数与最高帧率
+    max_frames: Optional[int] = None
+    max_fps: Optional[float] = None
+    # 透明图片是否保留透明通道（默认铺白底），以及透明通道的压缩质量
+    keep_alpha: bool = False
+    alpha_quality: Optional[int] = None
+    # 无损编码：不传时颜色少的图片（截图、图表）自动比较有损与无损，true / false 强制指定
+    lossless: Optional[bool] = None
+    # 响应式图片宽度档位，例如 [480, 960, 1920]；设置后图片链接改写为 <img srcset>
+    srcset_widths: Optional[List[int]] = None
+    # 静态图片编码器，例如 ["webp", "avif"]；多个时逐图保留最小的结果，默认 WebP
+    encoders: Optional[List[str]] = None
     output_dir: str = "images"
     use_image_bed: Optional[bool] = False
     image_bed_provider: Optional[str] = None
@@ -492,7 +548,38 @@ async def convert_markdown(request: ConversionRequest):
         os.makedirs(output_dir, exist_ok=True)
 
         # 创建图片处理器
-        processor = MarkdownImageProcessor(request.quality)
+        target_kwargs = {
+            k: v
+            for k, v in (
+                ("target_bytes", request.target_bytes),
+                ("min_ssim", request.min_ssim),
+                ("min_psnr", request.min_psnr),
+                ("time_budget", request.time_budget),
+                ("max_width", request.max_width),
+                ("max_height", request.max_height),
+                ("max_frames", request.max_frames),
+                ("max_fps", request.max_fps),
+            )
+            if v
+        }
+        # effort 为 0 时同样有效，不能按真值过滤
+        if request.effort is not None:
+            target_kwargs["effort"] = request.effort
+        if not request.use_cache:
+            target_kwargs["use_cache"] = False
+        if request.keep_alpha:
+            target_kwargs["keep_alpha"] = True
+        if request.alpha_quality is not None:
+            target_kwargs["alpha_quality"] = request.alpha_quality
+        if request.lossless is not None:
+            target_kwargs["lossless"] = request.lossless
+        if request.srcset_widths:
+            target_kwargs["srcset_widths"] = tuple(request.srcset_widths)
+        if request.encoders:
+            target_kwargs["encoder"] = tuple(request.encoders)
+        if request.dedupe_threshold is not None:
+            target_kwargs["dedupe_threshold"] = request.dedupe_threshold
+        processor = MarkdownImageProcessor(request.quality, **target_kwargs)
 
         # 设置进度回调（通过 WS 推送）
         async def progress_callback(progress: int, message: str):
@@ -554,6 +641,12 @@ async def convert_markdown(request: ConversionRequest):
                     "compressionRatio": stats.get("compression_ratio")
                     or stats.get("compressionRatio"),
                     "sizeSaved": stats.get("size_saved") or stats.get("sizeSaved"),
+                    "totalBytesFetched": stats.get("total_bytes_fetched"),
+                    # 每张图片的各阶段耗时与字节数，以及各阶段耗时百分位
+                    "images": _camel_keys(stats.get("images") or []),
+                    "stagePercentiles": _camel_keys(
+                        stats.get("stage_percentiles") or {}
+                    ),
                 }
         except Exception:
             norm_stats = stats or {}
@@ -607,7 +700,7 @@ async def convert_markdown(request: ConversionRequest):
                     "准备上传到图床...",
                 )
                 print("[upload] image bed enabled, provider=github")
-                # 简单策略：将 /static/<dir>/*.webp（或 <dir>/*.webp）提取为文件名并上传
+                # 简单策略：将 /static/<dir>/ 下的输出图片（或 <dir>/ 形式）提取为文件名并上传
                 replaced = new_markdown or ""
                 upload_dir = (OUTPUTS_ROOT / (request.output_dir or "images")).resolve()
                 urls_map = {}
@@ -615,10 +708,8 @@ async def convert_markdown(request: ConversionRequest):
 
                 dir_name = request.output_dir or "images"
                 # 同时匹配带 /static/ 前缀和纯相对路径两种形式
-                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                pattern_relative = (
-                    rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                )
+                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
+                pattern_relative = rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
                 keys = set(
                     re.findall(pattern_static, replaced, flags=re.IGNORECASE)
                 ) | set(re.findall(pattern_relative, replaced, flags=re.IGNORECASE))
@@ -644,7 +735,7 @@ async def convert_markdown(request: ConversionRequest):
                         recent_threshold_sec = 10 * 60  # 10 分钟内
                         candidates = []
                         for fn in os.listdir(upload_dir):
-                            if not fn.lower().endswith(".webp"):
+                            if not fn.lower().endswith(OUTPUT_EXTENSIONS):
                                 continue
                             full = os.path.join(str(upload_dir), fn)
                             try:
@@ -692,7 +783,7 @@ async def convert_markdown(request: ConversionRequest):
                     replaced = replaced.replace(f"/static/{dir_name}/{key}", url)
                     replaced = replaced.replace(f"{dir_name}/{key}", url)
                 new_markdown = replaced
-                # 清理本地已上传的 webp 文件
+                # 清理本地已上传的图片文件
                 deleted_count = 0
                 for lp in local_paths:
                     try:
@@ -724,10 +815,8 @@ async def convert_markdown(request: ConversionRequest):
                 import re
 
                 dir_name = request.output_dir or "images"
-                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                pattern_relative = (
-                    rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                )
+                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
+                pattern_relative = rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
                 keys = set(
                     re.findall(pattern_static, replaced, flags=re.IGNORECASE)
                 ) | set(re.findall(pattern_relative, replaced, flags=re.IGNORECASE))
@@ -755,7 +844,7 @@ async def convert_markdown(request: ConversionRequest):
                         recent_threshold_sec = 10 * 60
                         candidates = []
                         for fn in os.listdir(upload_dir):
-                            if not fn.lower().endswith(".webp"):
+                            if not fn.lower().endswith(OUTPUT_EXTENSIONS):
                                 continue
                             full = os.path.join(str(upload_dir), fn)
                             try:
@@ -831,10 +920,8 @@ async def convert_markdown(request: ConversionRequest):
                 import re
 
                 dir_name = request.output_dir or "images"
-                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                pattern_relative = (
-                    rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                )
+                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
+                pattern_relative = rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
                 keys = set(
                     re.findall(pattern_static, replaced, flags=re.IGNORECASE)
                 ) | set(re.findall(pattern_relative, replaced, flags=re.IGNORECASE))
@@ -860,7 +947,7 @@ async def convert_markdown(request: ConversionRequest):
                         recent_threshold_sec = 10 * 60
                         candidates = []
                         for fn in os.listdir(upload_dir):
-                            if not fn.lower().endswith(".webp"):
+                            if not fn.lower().endswith(OUTPUT_EXTENSIONS):
                                 continue
                             full = os.path.join(str(upload_dir), fn)
                             try:
@@ -939,10 +1026,8 @@ async def convert_markdown(request: ConversionRequest):
                 import re
 
                 dir_name = request.output_dir or "images"
-                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                pattern_relative = (
-                    rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                )
+                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
+                pattern_relative = rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
                 keys = set(
                     re.findall(pattern_static, replaced, flags=re.IGNORECASE)
                 ) | set(re.findall(pattern_relative, replaced, flags=re.IGNORECASE))
@@ -996,10 +1081,8 @@ async def convert_markdown(request: ConversionRequest):
                 import re
 
                 dir_name = request.output_dir or "images"
-                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                pattern_relative = (
-                    rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?\\.webp)"
-                )
+                pattern_static = rf"/static/{re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
+                pattern_relative = rf"(?<![\w/]){re.escape(dir_name)}/([^/\\?#]+?{OUTPUT_EXTENSION_PATTERN})"
                 keys = set(
                     re.findall(pattern_static, replaced, flags=re.IGNORECASE)
                 ) | set(re.findall(pattern_relative, replaced, flags=re.IGNORECASE))
@@ -1336,6 +1419,10 @@ async def test_imagebed_config(config: ImageBedConfig):
 
 
 if __name__ == "__main__":
+    # 打包环境下图片编码进程池需要 freeze_support 才能启动子进程
+    import multiprocessing
+
+    multiprocessing.freeze_support()
     # 在打包环境（PyInstaller）下禁用热重载，避免 watchfiles 反复重启
     is_frozen = bool(getattr(sys, "frozen", False))
     # 默认关闭 reload，避免 uvicorn 警告与开发/打包环境不一致导致的异常